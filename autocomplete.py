@@ -0,0 +1,91 @@
+from bisect import bisect_left
+import heapq
+import json
+import os
+from index_sidecar import load_sidecar, write_json
+
+# File (inside the index directory) with the sorted terms for the autocomplete
+TERM_INDEX_FILE = "autocomplete.json"
+# File (inside the index directory) with the unstemmed forms of the content terms and their counts, written by the indexer
+SURFACE_FORMS_FILE = "surface_forms.json"
+
+# Sorted term array with document frequencies, completes prefixes with a binary search
+# suggestions for one and two letter prefixes (many matching terms) are kept after the first request
+class TermIndex:
+    def __init__(self, terms, doc_freqs, limit=10):
+        self.terms = terms
+        self.doc_freqs = doc_freqs
+        self.limit = limit
+        self.short_prefixes = {}
+
+    # all terms starting with prefix, the most frequent first
+    def scan(self, prefix, limit):
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + "\uffff", start)
+        best = heapq.nlargest(limit, range(start, end), key=lambda i: (self.doc_freqs[i], -i))
+        return [self.terms[i] for i in best]
+
+    def complete(self, prefix, limit=10):
+        if not prefix:
+            return []
+        if len(prefix) <= 2 and limit <= self.limit:
+            if prefix not in self.short_prefixes:
+                self.short_prefixes[prefix] = self.scan(prefix, self.limit)
+            return self.short_prefixes[prefix][:limit]
+        return self.scan(prefix, limit)
+
+# Count the unstemmed form of every term of the texts, counts: stem -> {form: count} (changed in place)
+# analyzer: analyzer of the content field, so the stems are the terms of the index
+def count_surface_forms(analyzer, texts, counts=None):
+    counts = counts if counts is not None else {}
+    for text in texts:
+        for token in analyzer(text, keeporiginal=True):
+            forms = counts.setdefault(token.text, {})
+            form = token.original.lower()
+            forms[form] = forms.get(form, 0) + 1
+    return counts
+
+# Add the counts of new (stem -> {form: count}) to counts
+def add_surface_forms(counts, new):
+    for stem, new_forms in new.items():
+        forms = counts.setdefault(stem, {})
+        for form, count in new_forms.items():
+            forms[form] = forms.get(form, 0) + count
+
+# Load and save the unstemmed forms of the index directory, only the most frequent forms of a stem are saved
+def load_surface_forms(index_dir):
+    path = os.path.join(index_dir, SURFACE_FORMS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_surface_forms(index_dir, counts, max_forms=3):
+    write_json(os.path.join(index_dir, SURFACE_FORMS_FILE), {stem: dict(heapq.nlargest(max_forms, forms.items(), key=lambda item: item[1])) for stem, forms in counts.items()})
+
+# Terms of the fields with the number of documents (pages) containing them, terms of several fields are added up
+# stemmed content terms are suggested in their most frequent unstemmed form (terms without a recorded form as they are)
+def build_term_index(ix, fieldnames=("content", "file_name")):
+    surface_forms = load_surface_forms(ix.storage.folder)
+    doc_freqs = {}
+    with ix.reader() as reader:
+        for fieldname in fieldnames:
+            # fields without postings (e.g. STORED) have no terms
+            if fieldname not in reader.schema or not reader.schema[fieldname].indexed:
+                continue
+            for term, terminfo in reader.iter_field(fieldname):
+                term = term.decode("utf-8")
+                forms = surface_forms.get(term) if fieldname == "content" else None
+                if forms:
+                    term = max(sorted(forms), key=forms.get)
+                doc_freqs[term] = doc_freqs.get(term, 0) + terminfo.doc_frequency()
+    terms = sorted(doc_freqs)
+    return terms, [doc_freqs[term] for term in terms]
+
+# Load the term index stored alongside the index, it is rebuilt once per index generation
+def load_term_index(ix):
+    def build():
+        terms, doc_freqs = build_term_index(ix)
+        return {"terms": terms, "doc_freqs": doc_freqs}
+    stored = load_sidecar(ix, TERM_INDEX_FILE, build)
+    return TermIndex(stored["terms"], stored["doc_freqs"])
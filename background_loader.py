@@ -0,0 +1,113 @@
+import time # needed to measure the loading time
+import threading # needed to open the index while the web app already serves requests
+from whoosh.index import TOC # needed to read the generation on disk (the engines are pinned to the generation they opened)
+from index_sidecar import read_index_state # needed to load only generations of finished indexer runs
+
+# Version of an index: generation and time of its table of contents, by default of the latest generation on disk
+# (a new index created in the same directory starts again with a low generation)
+def index_version(ix, generation=None):
+    try:
+        if generation is None:
+            generation = TOC._latest_generation(ix.storage, ix.indexname)
+        return generation, ix.storage.file_modified(f"_{ix.indexname}_{generation}.toc")
+    except Exception:
+        return None
+
+# Opens the search engine of a web app in a background thread, so the app starts serving immediately
+# requests arriving before the engine is ready get a "loading" answer instead of waiting for the index
+# factory: function returning the opened and warmed up search engine, gets the previous engine (None at the start)
+# reload_interval: seconds between two checks for a new index version (None = only reload())
+# a new engine is swapped in when it is ready, running requests finish on the engine they started with
+# the thread is started with start() by the process that serves the requests (not on import of the app module)
+class BackgroundLoader:
+    def __init__(self, factory, reload_interval=None):
+        self.factory = factory
+        self.reload_interval = reload_interval
+        self.engine = None
+        self.version = None
+        self.error = None
+        self.ready = threading.Event()
+        # only one engine is opened at a time
+        self.load_lock = threading.Lock()
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    # start the background thread, only the first call starts it
+    def start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        self.load()
+        self.ready.set()
+        if not self.reload_interval:
+            return
+        seen = self.version
+        while True:
+            time.sleep(self.reload_interval)
+            engine = self.engine
+            if engine is None:
+                # the index could not be opened, try again (e.g. it is just being created)
+                self.load()
+                continue
+            version = index_version(engine.ix)
+            if version is not None and version != self.version and self.finished(engine.ix, version, seen):
+                self.load()
+            seen = version
+
+    # the indexer commits in batches: a new version is loaded when the indexer has marked its generation as finished
+    # (a full run starts with an empty generation), versions of indices without state file when they have not changed for one interval
+    @staticmethod
+    def finished(ix, version, seen):
+        try:
+            state = read_index_state(ix.storage.folder)
+        except (OSError, ValueError):
+            # the state file is just being replaced
+            return False
+        if state is None:
+            return version == seen
+        return state["generation"] == version[0]
+
+    # open a new engine and swap it in, the previous engine keeps serving until then
+    def load(self):
+        with self.load_lock:
+            previous = self.engine
+            t = time.time()
+            try:
+                engine = self.factory(previous)
+            except Exception as e:
+                # the app keeps running with the previous engine or shows the error instead of the search results
+                # (one line per new error, a missing index is tried again every interval)
+                error = f"{type(e).__name__}: {e}"
+                if error != self.error:
+                    print(f"Index could not be opened: {error}")
+                self.error = error
+                return False
+            # version of the generation the engine is pinned to (a commit while opening triggers one more reload)
+            self.engine, self.version, self.error = engine, index_version(engine.ix, engine.ix.latest_generation()), None
+            # searchers of the previous engine are closed when the running requests return them
+            if previous is not None:
+                previous.close()
+            print(f"Index {'reloaded' if previous is not None else 'loaded'} in {time.time() - t:.2f} s (generation {engine.ix.latest_generation()})")
+            return True
+
+    # open the index again in the background (e.g. from an admin endpoint), False if a reload is already running
+    def reload(self):
+        if self.load_lock.locked():
+            return False
+        threading.Thread(target=self.load, daemon=True).start()
+        return True
+
+    # wait until the engine is opened, returns the engine (None if it could not be opened)
+    def wait(self, timeout=None):
+        self.start()
+        self.ready.wait(timeout)
+        return self.engine
+
+    # message shown while the engine is not ready
+    def message(self):
+        if self.error:
+            return f"Der Index konnte nicht geöffnet werden ({self.error})."
+        return "Der Index wird geladen, bitte in einigen Sekunden erneut versuchen."
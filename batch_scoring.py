@@ -0,0 +1,237 @@
+from whoosh import query as wq
+from whoosh.searching import Results
+from whoosh.sorting import UnorderedList
+import numpy as np
+
+# Length of the smallest window (last - first position) that contains one position of every list
+# position merge: walk through all positions in order and keep the latest position of every term
+def min_window(position_lists):
+    merged = sorted((position, term) for term, positions in enumerate(position_lists) for position in positions)
+    latest = {}
+    best = None
+    for position, term in merged:
+        latest[term] = position
+        if len(latest) == len(position_lists):
+            span = position - min(latest.values())
+            if best is None or span < best:
+                best = span
+    return best
+
+# Vectorized version of CustomScoring for term queries (single terms and OR groups of terms)
+# postings are read in blocks, TF, IDF, position and proximity scores are computed with NumPy arrays
+# and summed per document, the ranking is the same as with CustomScoring (scores differ < 1e-9)
+# with window=True the proximity score measures how close together the different query terms are
+# (smallest window containing all query terms of the document) instead of the spacing of a single term
+class BatchScoring:
+    def __init__(self, settings, block_size=4096):
+        self.settings = settings
+        self.block_size = block_size
+        # document lengths per field, cached per index generation
+        self._lengths = {}
+        # column values (as numbered keys) per field, cached per index generation
+        self._keys = {}
+
+    # New scorer with other settings that shares the cached document lengths and keys
+    # (the settings of a scorer are never changed while a search may use them)
+    def with_settings(self, settings):
+        scorer = BatchScoring(settings, self.block_size)
+        scorer._lengths = self._lengths
+        scorer._keys = self._keys
+        return scorer
+
+    # Only plain term queries and OR groups of terms are supported, everything else uses the whoosh matchers
+    @staticmethod
+    def supports(q):
+        if isinstance(q, wq.Term):
+            return True
+        if isinstance(q, wq.Or):
+            return all(isinstance(sub, wq.Term) for sub in q.subqueries)
+        return False
+
+    # Length of the field of every document (-1 for deleted documents), computed once per index generation
+    def doc_lengths(self, searcher, fieldname):
+        key = (searcher.reader().generation(), fieldname)
+        lengths = self._lengths.get(key)
+        if lengths is None:
+            reader = searcher.reader()
+            lengths = np.full(reader.doc_count_all(), -1.0)
+            for docnum in reader.all_doc_ids():
+                lengths[docnum] = searcher.doc_field_length(docnum, fieldname)
+            # only the current generation is kept (changed in place, the dict is shared with with_settings())
+            self._lengths.clear()
+            self._lengths[key] = lengths
+        return lengths
+
+    # Values of a column field (e.g. path) and a key number per document (same key = same value), computed once per index generation
+    def doc_keys(self, searcher, fieldname):
+        key = (searcher.reader().generation(), fieldname)
+        keys = self._keys.get(key)
+        if keys is None:
+            values = list(searcher.reader().column_reader(fieldname))
+            keys = np.unique(values, return_inverse=True)
+            self._keys.clear()
+            self._keys[key] = keys
+        return keys
+
+    # Read the postings of a term in blocks of (global docnum, term frequency, first position, last position)
+    def posting_blocks(self, searcher, fieldname, text):
+        for subsearcher, offset in searcher.leaf_searchers():
+            reader = subsearcher.reader()
+            if (fieldname, text) not in reader:
+                continue
+            ids, freqs, firsts, lasts = [], [], [], []
+            matcher = reader.postings(fieldname, text)
+            # fields without positions (ID fields like author and path) only have a frequency, first and last position are 0
+            has_positions = matcher.supports("positions")
+            for docnum, value in matcher.items_as("positions" if has_positions else "frequency"):
+                positions = value if has_positions else [0] * value
+                ids.append(docnum + offset)
+                freqs.append(len(positions))
+                firsts.append(positions[0] if positions else 0)
+                lasts.append(positions[-1] if positions else 0)
+                if len(ids) == self.block_size:
+                    yield np.array(ids), np.array(freqs, dtype=float), np.array(firsts, dtype=float), np.array(lasts, dtype=float)
+                    ids, freqs, firsts, lasts = [], [], [], []
+            if ids:
+                yield np.array(ids), np.array(freqs, dtype=float), np.array(firsts, dtype=float), np.array(lasts, dtype=float)
+
+    # Custom score of a block of postings (same formula as CustomScoring.custom_score)
+    # fields without positions (positions=False) only get the term frequency and idf part
+    def score_block(self, idf, lengths, freqs, firsts, lasts, proximity_weight, positions=True):
+        if not positions:
+            return freqs + (self.settings["idf_weight"] * idf)
+        # position score: how close the first occurrence is to the beginning of the document
+        position_scores = np.where(freqs > 0, 1.0 - firsts / lengths, 0.0)
+        # proximity score: the average distance of consecutive positions is (last - first) / (n - 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            avg_distances = (lasts - firsts) / (freqs - 1)
+        proximity_scores = np.where(freqs > 1, 1.0 / (1.0 + avg_distances), 0.0)
+        return (
+            freqs +
+            (self.settings["idf_weight"] * idf) +
+            (self.settings["position_weight"] * position_scores) +
+            (proximity_weight * proximity_scores)
+        )
+
+    # Score all documents matching the query, returns an array of scores (NaN = no match)
+    # and the number of different query terms in every document
+    def score_all(self, searcher, q, window=False):
+        scores = np.full(searcher.doc_count_all(), np.nan)
+        term_counts = np.zeros(searcher.doc_count_all(), dtype=int)
+        # in window mode the proximity of single terms is replaced by the window score
+        proximity_weight = 0.0 if window else self.settings["proximity_weight"]
+        for term in self.query_terms(q):
+            fieldname, text = term.fieldname, term.text
+            positions = searcher.schema[fieldname].supports("positions")
+            # the field lengths are only needed for the position score (fields without positions have no length)
+            lengths = self.doc_lengths(searcher, fieldname) if positions else None
+            idf = searcher.idf(fieldname, text)
+            for ids, freqs, firsts, lasts in self.posting_blocks(searcher, fieldname, text):
+                block_scores = self.score_block(idf, lengths[ids] if positions else None, freqs, firsts, lasts, proximity_weight, positions) * term.boost
+                # documents matching several terms get the sum of the term scores (like whoosh's union matcher)
+                scores[ids] = np.where(np.isnan(scores[ids]), block_scores, scores[ids] + block_scores)
+                term_counts[ids] += 1
+        return scores, term_counts
+
+    @staticmethod
+    def query_terms(q):
+        return [q] if isinstance(q, wq.Term) else q.subqueries
+
+    # Window score of documents: 1 / (1 + gap) * share of query terms in the document
+    # gap = number of other words inside the smallest window containing all query terms of the document (0 = phrase)
+    def window_scores(self, searcher, q, docnums):
+        terms = self.query_terms(q)
+        reader = searcher.reader()
+        # positions[docnum] = list of position lists (one per query term found in the document)
+        positions = {docnum: [] for docnum in docnums}
+        for term in terms:
+            # terms of fields without positions have no place in the window
+            if (term.fieldname, term.text) not in reader or not searcher.schema[term.fieldname].supports("positions"):
+                continue
+            matcher = reader.postings(term.fieldname, term.text)
+            for docnum in docnums:
+                if not matcher.is_active():
+                    break
+                if matcher.id() < docnum:
+                    matcher.skip_to(docnum)
+                if matcher.is_active() and matcher.id() == docnum:
+                    positions[docnum].append(matcher.value_as("positions"))
+
+        window_scores = np.zeros(len(docnums))
+        for i, docnum in enumerate(docnums):
+            position_lists = [p for p in positions[docnum] if p]
+            if len(position_lists) < 2:
+                continue
+            gap = min_window(position_lists) - (len(position_lists) - 1)
+            window_scores[i] = (len(position_lists) / len(terms)) / (1.0 + gap)
+        return window_scores
+
+    # Add the weighted window score to the documents that can still reach the top results
+    # keys: collapse key of every document, the limit then counts the best document per key
+    def add_window_scores(self, searcher, q, scores, term_counts, matched, limit, keys=None):
+        proximity_weight = self.settings["proximity_weight"]
+        candidates = matched[term_counts[matched] >= 2]
+        if keys is None:
+            best_scores = scores[matched]
+        else:
+            best_scores = np.full(keys.max() + 1, -np.inf)
+            np.maximum.at(best_scores, keys[matched], scores[matched])
+            best_scores = best_scores[best_scores > -np.inf]
+        if limit and len(best_scores) > limit and proximity_weight >= 0:
+            # the window score is at most 1: documents below the current limit minus the weight can not move up
+            kth_score = -np.partition(-best_scores, limit - 1)[limit - 1]
+            candidates = candidates[scores[candidates] + proximity_weight >= kth_score]
+        if len(candidates):
+            scores[candidates] += proximity_weight * self.window_scores(searcher, q, candidates.tolist())
+
+    # Search with the same interface as searcher.search(q, limit=...), returns a whoosh Results object
+    # collapse: name of a column field, only the best document per value is returned (like collapse=FieldFacet(...)),
+    # results.groups(collapse) lists all matching documents of the returned values (like groupedby)
+    # filter: query restricting the allowed documents (like filter=... of whoosh)
+    def search(self, searcher, q, limit=10, window=False, collapse=None, filter=None):
+        # a single term has no window, it keeps the normal proximity score
+        window = window and len(self.query_terms(q)) > 1
+        scores, term_counts = self.score_all(searcher, q, window)
+        if filter is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[list(searcher.docs_for_query(filter))] = True
+            scores[~allowed] = np.nan
+        matched = np.flatnonzero(~np.isnan(scores))
+        values, keys = self.doc_keys(searcher, collapse) if collapse else (None, None)
+        if window:
+            self.add_window_scores(searcher, q, scores, term_counts, matched, limit, keys)
+        if collapse:
+            return self.collapse(searcher, q, scores, matched, limit, collapse, values, keys)
+        if limit and len(matched) > limit:
+            # partial sort: only the best `limit` documents are ordered, ties at the limit go to the lower document numbers
+            kth_score = -np.partition(-scores[matched], limit - 1)[limit - 1]
+            better = matched[scores[matched] > kth_score]
+            ties = matched[scores[matched] == kth_score]
+            best = np.concatenate([better, ties[:limit - len(better)]])
+        else:
+            best = matched
+        # same order as whoosh: score descending, then document number ascending
+        order = np.lexsort((best, -scores[best]))
+        top_n = [(float(scores[docnum]), int(docnum)) for docnum in best[order]]
+        results = Results(searcher, q, top_n, docset=set(matched.tolist()))
+        # there is no collector to count the matches, the total is already known
+        results._total = len(matched)
+        return results
+
+    # Best document per collapse key, ordered like whoosh (score descending, then document number ascending)
+    def collapse(self, searcher, q, scores, matched, limit, fieldname, values, keys):
+        ranked = matched[np.lexsort((matched, -scores[matched]))]
+        # np.unique returns the first (= best) position of every key in the ranking
+        _, first = np.unique(keys[ranked], return_index=True)
+        best = ranked[np.sort(first)][:limit or None]
+        top_n = [(float(scores[docnum]), int(docnum)) for docnum in best]
+        results = Results(searcher, q, top_n, docset=set(matched.tolist()))
+        results._total = len(matched)
+
+        # matching documents of the returned keys
+        groups = UnorderedList()
+        in_top = matched[np.isin(keys[matched], keys[best])]
+        for docnum in in_top.tolist():
+            groups.add(values[keys[docnum]].item(), docnum, None)
+        results._facetmaps = {fieldname: groups}
+        return results
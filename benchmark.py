@@ -0,0 +1,338 @@
+import os # needed to interact with the operating system
+import time # needed to measure processing time
+import random # needed to generate a synthetic corpus
+import shutil # needed to remove old benchmark indices
+import json # needed to read and write the judged queries
+import math # needed for the discounted gain of nDCG
+import argparse # needed to read command line options
+from multiprocessing import cpu_count # needed to choose the tested core counts
+from stopwords import english_stopwords, german_stopwords # mixed into the synthetic text
+from whoosh.index import open_dir # needed to open the benchmark index
+from whoosh.qparser import QueryParser, OrGroup # needed to parse benchmark queries
+from whoosh.scoring import BM25F # default ranking of whoosh, baseline of the relevance benchmark
+from custom_scoring import CustomScoring, load_field_stats
+from batch_scoring import BatchScoring
+from content_store import CONTENT_STORE_FILE, open_store
+import directory_indexer
+
+# Scoring settings used by the benchmarks (same as the defaults of the web app)
+default_settings = {"proximity_weight": 2.5, "position_weight": 1.5, "idf_weight": 1.2}
+
+# Function to generate a synthetic corpus of text files
+# words follow a zipf-like distribution, so the index has a realistic mix of frequent and rare terms
+# every topic has two words that are planted in some files (grade 2: both words often, grade 1: once or twice,
+# not relevant: only one of the words, but many times),
+# the topics are written as judged queries to the judgments file (one JSON line per query)
+def generate_corpus(corpus_dir, num_files=500, words_per_file=2000, vocabulary_size=20000, num_topics=20, judgments_path=None, seed=42):
+    rng = random.Random(seed)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 12))) for _ in range(vocabulary_size)]
+    vocabulary += english_stopwords + german_stopwords
+    weights = [1.0 / rank for rank in range(1, len(vocabulary) + 1)]
+    known = set(vocabulary)
+    topics = []
+    for _ in range(num_topics):
+        words = []
+        while len(words) < 2:
+            word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(5, 10)))
+            if word not in known:
+                known.add(word)
+                words.append(word)
+        files = rng.sample(range(num_files), k=min(num_files, 15))
+        # 5 files about the topic (grade 2) and 10 files mentioning it (grade 1)
+        grades = {i: 2 if rank < 5 else 1 for rank, i in enumerate(files)}
+        distractors = rng.sample(range(num_files), k=min(num_files, 10))
+        topics.append((words, grades, distractors))
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    for i in range(num_files):
+        words = rng.choices(vocabulary, weights=weights, k=words_per_file)
+        for topic_words, grades, distractors in topics:
+            if i in grades and grades[i] == 2:
+                planted = topic_words + [rng.choice(topic_words) for _ in range(rng.randint(10, 30))]
+            elif i in grades:
+                planted = [rng.choice(topic_words) for _ in range(rng.randint(1, 3))]
+            elif i in distractors:
+                planted = [topic_words[0]] * rng.randint(5, 40)
+            else:
+                continue
+            for word in planted:
+                words.insert(rng.randrange(len(words) + 1), word)
+        with open(os.path.join(corpus_dir, f"doc_{i:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write(" ".join(words))
+
+    if judgments_path:
+        with open(judgments_path, "w", encoding="utf-8") as f:
+            for topic_words, grades, _ in topics:
+                judged = {f"doc_{i:05d}.txt": grade for i, grade in grades.items()}
+                f.write(json.dumps({"query": " ".join(topic_words), "judgments": judged}) + "\n")
+    return corpus_dir
+
+# Function to measure the size of an index on disk (in MB), the content store is not part of the index
+def index_size_mb(index_dir):
+    return sum(os.path.getsize(os.path.join(index_dir, f)) for f in os.listdir(index_dir) if f != CONTENT_STORE_FILE) / (1024 * 1024)
+
+# Function to count the files and MB of a corpus folder (synthetic or an existing folder)
+def corpus_size(corpus_dir):
+    files, size = 0, 0
+    for root, _, names in os.walk(corpus_dir):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size / (1024 * 1024)
+
+# Function to compare indexing time of the single writer with the multi-process writer
+def bench_writer_procs(corpus_dir, index_dir, proc_counts):
+    files, corpus_mb = corpus_size(corpus_dir)
+    rows = []
+    for procs in proc_counts:
+        shutil.rmtree(index_dir, ignore_errors=True)
+        t = time.time()
+        directory_indexer.process_files_parallel([corpus_dir], index_dir, writer_procs=procs)
+        rows.append((procs, time.time() - t, index_size_mb(index_dir)))
+
+    print(f"\n=== Indexing time vs. writer processes ({files} files, {corpus_mb:.1f} MB) ===")
+    print(f"{'writer procs':>12} | {'time [s]':>9} | {'speedup':>7} | {'files/s':>8} | {'MB/s':>6} | {'size [MB]':>9}")
+    for procs, duration, size in rows:
+        print(f"{procs:>12} | {duration:>9.2f} | {rows[0][1] / duration:>7.2f} | {files / duration:>8.1f} | {corpus_mb / duration:>6.2f} | {size:>9.1f}")
+    return rows
+
+# Previous behaviour of CustomScoring: the upper limit is calculated with a scan over all terms of the field
+# every time a matcher asks for it, and posting blocks are never skipped
+class LexiconScanScoring(CustomScoring):
+    class CustomScorer(CustomScoring.CustomScorer):
+        def supports_block_quality(self):
+            return False
+
+        def max_quality(self):
+            reader = self.searcher.reader()
+            max_term_freq = max(info.max_weight() for _, info in reader.iter_field(self.fieldname))
+            max_idf = max(self.searcher.idf(self.fieldname, term) for term in reader.field_terms(self.fieldname))
+            return self.weighting.upper_bound(max_term_freq, max_idf)
+
+# Function to pick benchmark queries from the index lexicon (mix of frequent and rare terms, 1-3 terms per query)
+def sample_queries(ix, num_queries=50, seed=42):
+    rng = random.Random(seed)
+    with ix.reader() as reader:
+        terms = [(term.decode("utf-8"), info.doc_frequency()) for term, info in reader.iter_field("content")]
+    terms.sort(key=lambda term: term[1], reverse=True)
+    frequent = [term for term, _ in terms[:200]]
+    rare = [term for term, _ in terms[200:]] or frequent
+    queries = []
+    for _ in range(num_queries):
+        words = [rng.choice(frequent)] + rng.sample(rare, k=min(len(rare), rng.randint(0, 2)))
+        queries.append(" ".join(words))
+    return queries
+
+# Function to read a value of a sorted list at a percentile
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+# Function to measure query latency percentiles (in ms) of a weighting model
+def measure_latency(ix, weighting, queries, limit=30, repeat=3):
+    parser = QueryParser("content", ix.schema, group=OrGroup)
+    parsed = [parser.parse(query) for query in queries]
+    durations = []
+    with ix.searcher(weighting=weighting) as searcher:
+        for _ in range(repeat):
+            for query in parsed:
+                t = time.perf_counter()
+                searcher.search(query, limit=limit)
+                durations.append((time.perf_counter() - t) * 1000)
+    durations.sort()
+    return {p: percentile(durations, p) for p in (50, 95, 99)}
+
+# Function to measure cold query latency (in ms): every query runs on a newly opened index and searcher,
+# as the first search after a restart (the files may still be in the cache of the operating system)
+def measure_cold_latency(index_dir, weighting, queries, limit=30):
+    durations = []
+    for query in queries:
+        t = time.perf_counter()
+        ix = open_dir(index_dir)
+        with ix.searcher(weighting=weighting) as searcher:
+            searcher.search(QueryParser("content", ix.schema, group=OrGroup).parse(query), limit=limit)
+        durations.append((time.perf_counter() - t) * 1000)
+    durations.sort()
+    return {p: percentile(durations, p) for p in (50, 95, 99)}
+
+# Function to compare query latency of the custom score with lexicon scans (before) and precomputed limits (after)
+# (few queries, the lexicon scans make the previous behaviour very slow on large indices)
+def bench_max_quality(index_dir, num_queries=10):
+    ix = open_dir(index_dir)
+    queries = sample_queries(ix, num_queries)
+    t = time.perf_counter()
+    field_stats = load_field_stats(ix)
+    print(f"\nField statistics loaded in {(time.perf_counter() - t) * 1000:.1f} ms: {field_stats}")
+
+    rows = [
+        ("before (lexicon scan)", measure_latency(ix, LexiconScanScoring(default_settings), queries, repeat=1)),
+        ("after (precomputed limits)", measure_latency(ix, CustomScoring(default_settings, field_stats), queries, repeat=1))
+    ]
+    print("\n=== Query latency CustomScoring [ms] ===")
+    print(f"{'':<28} | {'p50':>8} | {'p95':>8} | {'p99':>8}")
+    for name, latency in rows:
+        print(f"{name:<28} | {latency[50]:>8.2f} | {latency[95]:>8.2f} | {latency[99]:>8.2f}")
+    return rows
+
+# Function to compare the vectorized scorer with the FunctionWeighting path (throughput and ranking differences)
+def bench_batch_scoring(index_dir, num_queries=50, limit=30, tolerance=1e-9):
+    ix = open_dir(index_dir)
+    queries = sample_queries(ix, num_queries)
+    parser = QueryParser("content", ix.schema, group=OrGroup)
+    parsed = [parser.parse(query) for query in queries]
+    custom = CustomScoring(default_settings, load_field_stats(ix))
+    batch = BatchScoring(default_settings)
+
+    with ix.searcher(weighting=custom) as searcher:
+        postings = sum(searcher.doc_frequency(term.fieldname, term.text) for q in parsed for term in q.leaves())
+        # the document lengths are cached once per index generation, load them before measuring
+        batch.doc_lengths(searcher, "content")
+
+        t = time.perf_counter()
+        function_results = [[(hit.docnum, hit.score) for hit in searcher.search(q, limit=limit)] for q in parsed]
+        function_time = time.perf_counter() - t
+        t = time.perf_counter()
+        batch_results = [[(hit.docnum, hit.score) for hit in batch.search(searcher, q, limit=limit)] for q in parsed]
+        batch_time = time.perf_counter() - t
+
+    # rankings must be identical, scores may only differ by floating point rounding
+    ranking_mismatches = sum(1 for a, b in zip(function_results, batch_results) if [d for d, _ in a] != [d for d, _ in b])
+    max_difference = max((abs(sa - sb) for a, b in zip(function_results, batch_results) for (_, sa), (_, sb) in zip(a, b)), default=0.0)
+
+    print("\n=== Scoring throughput ===")
+    print(f"{'':<20} | {'queries/s':>10} | {'postings/s':>12}")
+    print(f"{'FunctionWeighting':<20} | {len(parsed) / function_time:>10.1f} | {postings / function_time:>12.0f}")
+    print(f"{'BatchScoring':<20} | {len(parsed) / batch_time:>10.1f} | {postings / batch_time:>12.0f}")
+    print(f"Ranking mismatches: {ranking_mismatches} of {len(parsed)} queries, max score difference: {max_difference:.2e} (tolerance {tolerance:.0e})")
+    return function_time, batch_time, ranking_mismatches, max_difference
+
+# Function to compare the index with stored content and the index with an external content store
+# (index size, store size, time to open the index and run the first search, time to read the text of 10 hits)
+def bench_content_store(corpus_dir, index_dir):
+    targets = {False: f"{index_dir}_stored", True: f"{index_dir}_store"}
+    for content_store, target in targets.items():
+        shutil.rmtree(target, ignore_errors=True)
+        directory_indexer.process_files_parallel([corpus_dir], target, content_store=content_store)
+    query_text = sample_queries(open_dir(targets[False]), 1)[0]
+
+    rows = []
+    for content_store, target in targets.items():
+        store_path = os.path.join(target, CONTENT_STORE_FILE)
+        store_mb = os.path.getsize(store_path) / (1024 * 1024) if os.path.exists(store_path) else 0.0
+        t = time.perf_counter()
+        ix = open_dir(target)
+        with ix.searcher() as searcher:
+            hits = searcher.search(QueryParser("content", ix.schema).parse(query_text), limit=10)
+            open_time = time.perf_counter() - t
+            t = time.perf_counter()
+            store = open_store(target)
+            texts = [store.get(hit["path"], hit["page"]) if store else hit["content"] for hit in hits]
+            read_time = time.perf_counter() - t
+        rows.append(("content store" if content_store else "stored content", index_size_mb(target), store_mb, open_time, read_time, len(texts)))
+
+    print("\n=== Stored content vs. content store ===")
+    print(f"{'':<16} | {'index [MB]':>10} | {'store [MB]':>10} | {'open + search [ms]':>18} | {'read 10 hits [ms]':>17}")
+    for name, size, store_mb, open_time, read_time, _ in rows:
+        print(f"{name:<16} | {size:>10.1f} | {store_mb:>10.1f} | {open_time * 1000:>18.1f} | {read_time * 1000:>17.2f}")
+    return rows
+
+# Function to read the judged queries, one JSON line per query: {"query": ..., "judgments": {file name: grade}}
+# grade 0 = not relevant, 1 = relevant, 2 = highly relevant (files without judgment are not relevant)
+def load_judgments(judgments_path):
+    with open(judgments_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Function to read a query log (one query per line)
+def load_queries(queries_path):
+    with open(queries_path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+# Function to rank the files of a query, the pages are grouped by file name as in the result list of the web app
+def ranked_files(searcher, parser, query, k=10):
+    files = []
+    for hit in searcher.search(parser.parse(query), limit=k * 10):
+        if hit["file_name"] not in files:
+            files.append(hit["file_name"])
+            if len(files) == k:
+                break
+    return files
+
+# nDCG@k of a ranked list of files (gain 2^grade - 1, log2 discount)
+def ndcg(files, judgments, k=10):
+    dcg = sum((2 ** judgments.get(name, 0) - 1) / math.log2(rank + 2) for rank, name in enumerate(files[:k]))
+    ideal = sorted(judgments.values(), reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return dcg / idcg if idcg else 0.0
+
+# reciprocal rank of the first relevant file (0 if no relevant file was found)
+def reciprocal_rank(files, judgments):
+    for rank, name in enumerate(files, start=1):
+        if judgments.get(name, 0) > 0:
+            return 1.0 / rank
+    return 0.0
+
+# Function to compare the rankings of CustomScoring (default and web app settings) with whoosh's BM25F
+# nDCG@k and MRR of the judged queries, cold and warm latency of the query log
+def bench_relevance(index_dir, judgments_path, queries=None, settings_path="settings.json", k=10, repeat=3):
+    ix = open_dir(index_dir)
+    judged = load_judgments(judgments_path)
+    queries = queries or [entry["query"] for entry in judged] + sample_queries(ix)
+    field_stats = load_field_stats(ix)
+    weightings = [
+        ("BM25F", BM25F()),
+        ("CustomScoring (default)", CustomScoring(default_settings, field_stats))
+    ]
+    if settings_path and os.path.exists(settings_path):
+        with open(settings_path, "r") as f:
+            settings = {**default_settings, **json.load(f)}
+        if settings != default_settings:
+            weightings.append((f"CustomScoring ({os.path.basename(settings_path)})", CustomScoring(settings, field_stats)))
+
+    rows = []
+    parser = QueryParser("content", ix.schema, group=OrGroup)
+    for name, weighting in weightings:
+        with ix.searcher(weighting=weighting) as searcher:
+            rankings = [(ranked_files(searcher, parser, entry["query"], k), entry["judgments"]) for entry in judged]
+        quality = (
+            sum(ndcg(files, judgments, k) for files, judgments in rankings) / len(rankings),
+            sum(reciprocal_rank(files, judgments) for files, judgments in rankings) / len(rankings)
+        )
+        rows.append((name, quality, measure_cold_latency(index_dir, weighting, queries), measure_latency(ix, weighting, queries, repeat=repeat)))
+
+    print(f"\n=== Relevance ({len(judged)} judged queries) and latency ({len(queries)} queries) ===")
+    print(f"{'':<32} | {f'nDCG@{k}':>7} | {'MRR':>6} | {'cold p50':>8} | {'cold p95':>8} | {'warm p50':>8} | {'warm p95':>8} | {'warm p99':>8}")
+    for name, (ndcg_k, mrr), cold, warm in rows:
+        print(f"{name:<32} | {ndcg_k:>7.3f} | {mrr:>6.3f} | {cold[50]:>8.2f} | {cold[95]:>8.2f} | {warm[50]:>8.2f} | {warm[95]:>8.2f} | {warm[99]:>8.2f}")
+    print("Latency in ms, cold: newly opened index per query, warm: one searcher, queries repeated")
+    return rows
+
+# Main program
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmarks for the CAS search engine.")
+    arg_parser.add_argument("--corpus", default="benchmark_corpus", help="folder for the synthetic corpus (or an existing folder to index)")
+    arg_parser.add_argument("--index", default="benchmark_index", help="folder for the benchmark index")
+    arg_parser.add_argument("--files", type=int, default=500, help="number of synthetic files")
+    arg_parser.add_argument("--words", type=int, default=2000, help="words per synthetic file")
+    arg_parser.add_argument("--topics", type=int, default=20, help="number of judged topics in the synthetic corpus")
+    arg_parser.add_argument("--judgments", help="file with judged queries (default: written next to the synthetic corpus)")
+    arg_parser.add_argument("--queries", help="query log for the latency measurement (one query per line)")
+    arg_parser.add_argument("--settings", default="settings.json", help="scoring settings compared with the defaults")
+    arg_parser.add_argument("--procs", type=int, nargs="+", default=sorted({1, 2, 4, max(1, cpu_count() - 2)}), help="writer process counts to compare")
+    arg_parser.add_argument("--bench", nargs="+", default=["indexing", "scoring"], choices=["indexing", "scoring", "batch", "store", "relevance"], help="benchmarks to run")
+    args = arg_parser.parse_args()
+
+    judgments_path = args.judgments or f"{args.corpus.rstrip(os.sep)}_judgments.jsonl"
+    if not os.path.exists(args.corpus):
+        generate_corpus(args.corpus, num_files=args.files, words_per_file=args.words, num_topics=args.topics, judgments_path=judgments_path)
+    if "indexing" in args.bench or not os.path.exists(args.index):
+        bench_writer_procs(args.corpus, args.index, args.procs if "indexing" in args.bench else [1])
+    if "scoring" in args.bench:
+        bench_max_quality(args.index)
+    if "batch" in args.bench:
+        bench_batch_scoring(args.index)
+    if "store" in args.bench:
+        bench_content_store(args.corpus, args.index)
+    if "relevance" in args.bench:
+        if os.path.exists(judgments_path):
+            bench_relevance(args.index, judgments_path, load_queries(args.queries) if args.queries else None, args.settings)
+        else:
+            print(f"\nNo judged queries found ({judgments_path}), use --judgments or remove the corpus folder to generate a new one.")
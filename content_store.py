@@ -0,0 +1,52 @@
+import os # needed to interact with the operating system
+import zlib # needed to compress the page text
+import sqlite3 # needed to store the page text on disk
+import threading # needed to share the store between the request threads of the web apps
+
+# File (inside the index directory) with the page text, used when the index does not store the content
+CONTENT_STORE_FILE = "content_store.sqlite"
+
+# Compressed page text outside of the index, keyed by (path, page)
+# the index only keeps the postings of the content, the text is read for the shown hits (snippets)
+class ContentStore:
+    def __init__(self, store_path, readonly=False):
+        self.store_path = store_path
+        self.lock = threading.Lock()
+        if readonly:
+            # the web apps only read, the connection is shared by the request threads (every access holds the lock)
+            self.db = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.db = sqlite3.connect(store_path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS pages (path TEXT, page INTEGER, data BLOB, PRIMARY KEY (path, page)) WITHOUT ROWID")
+            self.db.commit()
+
+    def put(self, path, page, text):
+        self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (path, page, zlib.compress(text.encode("utf-8"))))
+
+    # returns the text of a page or None
+    def get(self, path, page):
+        with self.lock:
+            row = self.db.execute("SELECT data FROM pages WHERE path = ? AND page = ?", (path, page)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    # remove all pages of a file (deleted or changed files)
+    def delete(self, path):
+        self.db.execute("DELETE FROM pages WHERE path = ?", (path,))
+
+    def clear(self):
+        self.db.execute("DELETE FROM pages")
+        self.db.commit()
+        self.db.execute("VACUUM")
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+# Function to open the content store of an index for reading (None if the index stores the content itself)
+def open_store(index_dir):
+    store_path = os.path.join(index_dir, CONTENT_STORE_FILE)
+    if os.path.exists(store_path):
+        return ContentStore(store_path, readonly=True)
+    return None
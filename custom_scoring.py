@@ -0,0 +1,118 @@
+from whoosh.scoring import FunctionWeighting
+from math import log
+from index_sidecar import load_sidecar
+
+# File (inside the index directory) with precomputed statistics per field
+FIELD_STATS_FILE = "field_stats.json"
+
+# Calculate maximum term frequency and maximum IDF per field (one scan over the lexicon)
+def compute_field_stats(ix, fieldnames=("content",)):
+    stats = {}
+    with ix.reader() as reader:
+        doc_count = reader.doc_count_all()
+        for fieldname in fieldnames:
+            if fieldname not in reader.schema:
+                continue
+            max_tf = 0.0
+            min_doc_freq = None
+            for _, terminfo in reader.iter_field(fieldname):
+                max_tf = max(max_tf, terminfo.max_weight())
+                if min_doc_freq is None or terminfo.doc_frequency() < min_doc_freq:
+                    min_doc_freq = terminfo.doc_frequency()
+            if min_doc_freq is None:
+                continue
+            stats[fieldname] = {
+                "max_tf": max_tf,
+                # same formula as whoosh's idf, the rarest term has the highest idf
+                "max_idf": log(doc_count / (min_doc_freq + 1)) + 1
+            }
+    return stats
+
+# Load the field statistics stored alongside the index, they are recomputed once per index generation
+def load_field_stats(ix):
+    return load_sidecar(ix, FIELD_STATS_FILE, lambda: {"fields": compute_field_stats(ix)})["fields"]
+
+# Custom scoring function
+class CustomScoring(FunctionWeighting):
+    def __init__(self, settings, field_stats=None):
+        self.settings = settings
+        self.field_stats = field_stats or {}
+        super().__init__(self.custom_score)
+
+    def scorer(self, searcher, fieldname, text, qf=1):
+        return self.CustomScorer(self, searcher, fieldname, text, qf=qf)
+
+    def custom_score(self, searcher, fieldname, text, matcher):
+        # Get term frequency
+        term_freq = matcher.value_as("frequency")
+
+        # Get IDF score
+        idf = searcher.idf(fieldname, text)
+
+        # POSITION SCORING
+        # Get positions and calculate position score
+        # fields without positions (ID fields like author and path) get no position and proximity score
+        positions = matcher.value_as("positions") if matcher.supports("positions") else []
+        if positions:
+            # Normalize position score based on document length
+            doc_length = searcher.doc_field_length(matcher.id(), fieldname)
+            # Rate position based on how close it is to the beginning of the document
+            position_score = 1.0 - (min(positions) / doc_length)
+        else:
+            position_score = 0.0
+
+        # PROXIMITY SCORING
+        # Calculate proximity score based on term positions
+        if positions and len(positions) > 1:
+            # Calculate average distance between consecutive positions
+            distances = [positions[i+1] - positions[i] for i in range(len(positions)-1)]
+            avg_distance = sum(distances) / len(distances)
+            # Rate proximity based on average distance between terms
+            proximity_score = 1.0 / (1.0 + avg_distance)
+        else:
+            proximity_score = 0.0
+
+        # Apply weights and combine scores
+        weighted_score = (
+            term_freq +
+            (self.settings["idf_weight"] * idf) +
+            (self.settings["position_weight"] * position_score) +
+            (self.settings["proximity_weight"] * proximity_score)
+        )
+
+        return weighted_score
+
+    # Upper limit of custom_score for a term frequency and idf
+    # position score is at most 1, proximity score at most 0.5 (consecutive positions are at least 1 apart)
+    def upper_bound(self, max_term_freq, idf):
+        return (
+            max_term_freq +
+            (self.settings["idf_weight"] * idf) +
+            (max(self.settings["position_weight"], 0.0) * 1.0) +
+            (max(self.settings["proximity_weight"], 0.0) * 0.5)
+        )
+
+    # Max quality of a field, based on the precomputed statistics (no lexicon scan at query time)
+    def max_quality(self, searcher, fieldname):
+        stats = self.field_stats.get(fieldname)
+        if not stats:
+            return 0.0
+        return self.upper_bound(stats["max_tf"], stats["max_idf"])
+
+    # Scorer with quality limits per term and per posting block,
+    # lets whoosh skip blocks that can not reach the current top results
+    class CustomScorer(FunctionWeighting.FunctionScorer):
+        def __init__(self, weighting, searcher, fieldname, text, qf=1):
+            super().__init__(weighting.custom_score, searcher, fieldname, text, qf=qf)
+            self.weighting = weighting
+            self.idf = searcher.idf(fieldname, text)
+            self.max_weight = searcher.term_info(fieldname, text).max_weight()
+
+        def supports_block_quality(self):
+            return True
+
+        def max_quality(self):
+            return self.weighting.upper_bound(self.max_weight, self.idf)
+
+        def block_quality(self, matcher):
+            return self.weighting.upper_bound(matcher.block_max_weight(), self.idf)
@@ -1,170 +1,419 @@
 import os # needed to interact with the operating system
 import time # needed to measure processing time
+import json # needed to store the manifest for incremental indexing
+import hashlib # needed to detect changed file content
+import argparse # needed to read command line options
+import threading # needed for the time limit of an extraction on Windows
+import heapq # needed to order the discovered tasks largest first
+import fnmatch # needed for the include/exclude patterns of the scanner
+import queue # needed to collect the results of the workers
+import signal # needed for the time limit of an extraction
+try:
+    import resource # needed for the memory limit of the workers (not available on Windows)
+except ImportError:
+    resource = None
 from datetime import datetime # needed to extract metadata
 import traceback # allows error reporting
 from multiprocessing import Pool, cpu_count # allows parallelized computing
 from tqdm import tqdm # allows visualizing state of a process
 from stopwords import english_stopwords, german_stopwords # needed to remove stopwords
-from whoosh.fields import Schema, TEXT, NUMERIC # needed to create whoosh index
-from whoosh.index import create_in # needed to create whoosh index
+from extraction_cache import ExtractionCache, open_readonly # needed to reuse extracted text
+from custom_scoring import load_field_stats # needed to precompute scoring statistics
+from autocomplete import load_term_index, count_surface_forms, add_surface_forms, load_surface_forms, save_surface_forms, SURFACE_FORMS_FILE # needed to prebuild the autocomplete terms
+from index_sidecar import write_json, write_index_state # needed to save the manifest and to mark finished runs for the web apps
+from content_store import ContentStore, CONTENT_STORE_FILE # needed to keep the page text outside of the index
+from whoosh.fields import Schema, TEXT, ID, NUMERIC, DATETIME # needed to create whoosh index
+from whoosh.index import create_in, open_dir, exists_in # needed to create or update whoosh index
 from whoosh.analysis import StemmingAnalyzer, StopFilter # needed to create whoosh index
-import tkinter as tk # needed for GUI-interface to select files
-from tkinter import filedialog # needed for GUI-interface to select files
-from PyPDF2 import PdfReader # needed to extract pdf data
-import pptx # needed to process ppt-files
-from markdown2 import markdown_path # needed to process markdown-files
-from nbconvert import HTMLExporter # needed to process Jupyter Notebook files
+# the extractors (PyPDF2, pptx, markdown2, nbconvert) and tkinter are imported when they are first needed,
+# so the indexer starts fast, only needs the libraries of the file types found and runs on servers without display
 
 # Initialize variables
 unsupported_files = []
 error_logs = []
 supported_filetypes = [".pdf", ".txt", ".csv", ".py", ".ipynb", ".html", ".r", ".qmd", ".pptx"]
+manifest_file = "manifest.json" # stores path, mtime, size and hash of every indexed file
+report_file = "extraction_report.jsonl" # one line per task with file type, pages, time and status
+pdf_pages_per_task = 50 # PDFs with more pages are split into page ranges, which are processed by different workers
+pdf_split_min_mb = 1 # only PDFs of at least this size are opened to count their pages (smaller files are not worth splitting)
+plan_window = 1000 # number of discovered tasks kept back to hand them to the workers largest first
+extractor_version = 1 # increase when the extraction functions change, so cached text is extracted again
+worker_cache = None # extraction cache of a worker process (opened read-only by init_worker)
+worker_timeout = None # time limit (s) of an extraction in a worker process (set by init_worker)
+worker_analyzer = None # analyzer of the content field in a worker process (set by content_analyzer)
+file_timeout = 300 # seconds an extraction may take before the file is skipped
+file_memory_mb = 2048 # additional memory a worker may allocate for one file before it is skipped (Linux)
+tasks_per_worker = 50 # worker processes are replaced after this many tasks, so memory of large parses is returned
+
+# Raised when an extraction takes longer than the time limit
+# derived from BaseException, so the except Exception blocks of the extractors (e.g. PyPDF2) do not swallow it
+class ExtractionTimeout(BaseException):
+    pass
 
 # Function to extract metadata
 def extract_metadata(filepath):
-    try:
-        stat = os.stat(filepath)
-        # create dictionary entry for extracted metadata
-        metadata = {
-            "Filename": os.path.basename(filepath),
-            "Path": filepath,
-            "Author": "Unknown",
-            "CreateDate": datetime.fromtimestamp(stat.st_ctime).strftime("%Y-%m-%d %H:%M:%S"),
-            "Pages": 0
-        }
-        return metadata
-    # log errors in log-file
-    except Exception as e:
-        log_error(filepath, "Metadata extraction failed: " + str(e))
-        return None
+    stat = os.stat(filepath)
+    # create dictionary entry for extracted metadata
+    metadata = {
+        "Filename": os.path.basename(filepath),
+        "Path": filepath,
+        "Author": "Unknown",
+        "CreateDate": datetime.fromtimestamp(stat.st_ctime).replace(microsecond=0),
+        "Pages": 0
+    }
+    return metadata
 
-# Function to log errors
+# Function to create an error record in a worker, the parent process adds it to the error log
+def error_record(filepath, stage, message):
+    return {"path": filepath, "stage": stage, "message": message}
+
+# Function to log errors (only in the parent process, workers return error records)
 def log_error(filepath, message):
     error_logs.append(f"Error processing {filepath}: {message}")
     unsupported_files.append(filepath)
 
+# Function to calculate a content hash (read in chunks to keep memory low)
+def file_hash(filepath):
+    sha1 = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+# Functions to load and save the manifest of indexed files (path -> mtime, size, hash)
+def load_manifest(index_dir):
+    manifest_path = os.path.join(index_dir, manifest_file)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(index_dir, manifest):
+    # written to a temporary file first, so an interrupted run never leaves a broken manifest
+    write_json(os.path.join(index_dir, manifest_file), manifest)
+
+# Function to extract the text of a file, returns the author and a list of (page number, text)
+# for PDF files first_page and last_page (1-based, inclusive) restrict the extraction to a page range
+def extract_pages(filepath, file_ext, first_page=None, last_page=None):
+    author = "Unknown"
+    pages = []
+    # extraction function for PDF files
+    if file_ext == ".pdf":
+        from PyPDF2 import PdfReader # needed to extract pdf data
+        reader = PdfReader(filepath)
+        author = reader.metadata.get("/Author", "Unknown")
+        first_page = first_page or 1
+        last_page = last_page or len(reader.pages)
+        for page_number in range(first_page, last_page + 1):
+            text = reader.pages[page_number - 1].extract_text() or ""
+            pages.append((page_number, text.strip()))
+
+    # extraction function for TXT, CSV, PY, HTML and R files
+    elif file_ext in [".txt", ".csv", ".py", ".html", ".r"]:
+        with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
+            pages.append((1, f.read().strip()))
+
+    # extraction function for Jupyter Notebook files
+    elif file_ext == ".ipynb":
+        from nbconvert import HTMLExporter # needed to process Jupyter Notebook files
+        with open(filepath, "r", encoding="utf-8") as f:
+            notebook_content = f.read()
+            exporter = HTMLExporter()
+            html_content, _ = exporter.from_notebook_node(notebook_content)
+            pages.append((1, html_content.strip()))
+
+    # extraction function for QMD files
+    elif file_ext == ".qmd":
+        from markdown2 import markdown_path # needed to process markdown-files
+        pages.append((1, markdown_path(filepath).strip()))
+
+    # extraction function for PPTX files
+    elif file_ext == ".pptx":
+        import pptx # needed to process ppt-files
+        presentation = pptx.Presentation(filepath)
+        slide_texts = []
+        for slide in presentation.slides:
+            for shape in slide.shapes:
+                if shape.has_text_frame:
+                    slide_texts.append(shape.text)
+        pages.append((1, "\n".join(slide_texts).strip()))
+
+    return str(author), pages
+
 # Worker function to process a single file
-def process_file(filepath):
+# for PDF files first_page and last_page (1-based, inclusive) restrict the extraction to a page range
+# returns the documents for the index, whether the text was read from the extraction cache and an error record (or None)
+def process_file(filepath, first_page=None, last_page=None, cache_key=None):
     global supported_filetypes
     # extract file extension
     file_ext = os.path.splitext(filepath)[1].lower()
     # call metadata extraction function
-    metadata = extract_metadata(filepath)
-    if not metadata:
-        return None
+    try:
+        metadata = extract_metadata(filepath)
+    except Exception as e:
+        return None, False, error_record(filepath, "metadata", "Metadata extraction failed: " + str(e))
 
-    # log error, if filetype not supported
+    # error record, if filetype not supported
     if file_ext not in supported_filetypes:
-        log_error(filepath, "Unsupported file type")
-        return None
+        return None, False, error_record(filepath, "unsupported", "Unsupported file type")
 
-    results = [] # object to store index-data
     try:
-        # extraction function for PDF files
-        if file_ext == ".pdf":
-            reader = PdfReader(filepath)
-            metadata["Pages"] = len(reader.pages)
-            metadata["Author"] = reader.metadata.get("/Author", "Unknown")
-            for page_number, page in enumerate(reader.pages, start=1):
-                text = page.extract_text() or ""
-                results.append({
-                    "file_name": str(metadata["Filename"]),
-                    "path": str(metadata["Path"]),
-                    "author": str(metadata["Author"]),
-                    "create_date": str(metadata["CreateDate"]),
-                    "page": int(page_number),
-                    "content": str(text.strip())
-                })
-
-        # extraction function for TXT, CSV, PY, HTML files
-        elif file_ext in [".txt", ".csv", ".py", ".html"]:
-            with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read()
-                results.append({
-                    "file_name": metadata["Filename"],
-                    "path": metadata["Path"],
-                    "author": metadata["Author"],
-                    "create_date": metadata["CreateDate"],
-                    "page": 1,
-                    "content": text.strip()
-                })
-
-        # extraction function for Jupyter Notebook files
-        elif file_ext == ".ipynb":
-            with open(filepath, "r", encoding="utf-8") as f:
-                notebook_content = f.read()
-                exporter = HTMLExporter()
-                html_content, _ = exporter.from_notebook_node(notebook_content)
-                results.append({
-                    "file_name": metadata["Filename"],
-                    "path": metadata["Path"],
-                    "author": metadata["Author"],
-                    "create_date": metadata["CreateDate"],
-                    "page": 1,
-                    "content": html_content.strip()
-                })
-
-        # extraction function for R files
-        elif file_ext == ".r":
-            with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read()
-                results.append({
-                    "file_name": metadata["Filename"],
-                    "path": metadata["Path"],
-                    "author": metadata["Author"],
-                    "create_date": metadata["CreateDate"],
-                    "page": 1,
-                    "content": text.strip()
-                })
-
-        # extraction function for PDF files
-        elif file_ext == ".qmd":
-            html_content = markdown_path(filepath)
-            results.append({
-                "file_name": metadata["Filename"],
-                "path": metadata["Path"],
-                "author": metadata["Author"],
-                "create_date": metadata["CreateDate"],
-                "page": 1,
-                "content": html_content.strip()
-            })
+        cached = worker_cache.get(cache_key) if worker_cache and cache_key else None
+        if cached:
+            metadata["Author"], pages = cached
+        else:
+            metadata["Author"], pages = with_time_limit(worker_timeout, extract_pages, filepath, file_ext, first_page, last_page)
 
-        # extraction function for PPTX files
-        elif file_ext == ".pptx":
-            presentation = pptx.Presentation(filepath)
-            slide_texts = []
-            for slide in presentation.slides:
-                for shape in slide.shapes:
-                    if shape.has_text_frame:
-                        slide_texts.append(shape.text)
+        # object to store index-data
+        results = []
+        for page_number, text in pages:
             results.append({
-                "file_name": metadata["Filename"],
-                "path": metadata["Path"],
-                "author": metadata["Author"],
+                "file_name": str(metadata["Filename"]),
+                "path": str(metadata["Path"]),
+                "author": str(metadata["Author"]),
                 "create_date": metadata["CreateDate"],
-                "page": 1,
-                "content": "\n".join(slide_texts).strip()
+                "page": int(page_number),
+                "content": str(text)
             })
+        return results, cached is not None, None
 
-        return results
-
-    # Log errors in log-file
+    except ExtractionTimeout:
+        return None, False, error_record(filepath, "timeout", f"Extraction took longer than {worker_timeout} s. Skipping.")
+    except MemoryError:
+        return None, False, error_record(filepath, "memory", "Extraction exceeded the memory limit. Skipping.")
+    # the traceback goes to the error log of the parent process
     except Exception as e:
-        log_error(filepath, traceback.format_exc())
-        return None
+        return None, False, error_record(filepath, "extract", traceback.format_exc())
 
-# Main function to process files in parallel
-def process_files_parallel(folders_to_index, index_dir):
-    files_to_process = []
-    for folder_path in folders_to_index:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                files_to_process.append(os.path.join(root, file))
+# Worker initializer: open the extraction cache read-only in every worker process
+# and set the time and memory limits of the extractions
+def init_worker(cache_path, timeout=None, memory_mb=None):
+    global worker_cache, worker_timeout
+    worker_cache = open_readonly(cache_path)
+    worker_timeout = timeout
+    if timeout and hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, raise_timeout)
+    if memory_mb:
+        limit_memory(memory_mb)
 
-    # defines amount of used processors for parallelizing (max - 2), adjust if needed
-    num_workers = max(1, cpu_count() - 2)
-    print(f"Processing {len(files_to_process)} files using {num_workers} workers...")
+def raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+# Function to call function(*args) with a time limit, raises ExtractionTimeout
+# uses SIGALRM where available, otherwise (Windows) the function runs in a thread and the worker stops waiting for it
+# (the thread can not be stopped, the worker process is replaced after tasks_per_worker tasks)
+# threaded=True always uses the thread (main process: no SIGALRM handler, the planner may not run in the main thread)
+def with_time_limit(seconds, function, *args, threaded=False):
+    if not seconds:
+        return function(*args)
+    if hasattr(signal, "SIGALRM") and not threaded:
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        try:
+            return function(*args)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    outcome = {}
+    def run():
+        try:
+            outcome["result"] = function(*args)
+        except BaseException as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    if thread.is_alive():
+        raise ExtractionTimeout()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+# Function to limit the address space of a worker process to its current size plus memory_mb (Linux),
+# allocations beyond the limit raise a MemoryError in the extraction instead of swapping or getting killed
+def limit_memory(memory_mb):
+    if resource is None or not hasattr(resource, "RLIMIT_AS"):
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        current = 0
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current + memory_mb * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+# Function to get the analyzer of the content field (created once per process)
+def content_analyzer():
+    global worker_analyzer
+    if worker_analyzer is None:
+        worker_analyzer = create_schema()["content"].analyzer
+    return worker_analyzer
+
+# Worker function to process a task (filepath, first_page, last_page)
+# the content hash is needed for the manifest (once per file) and as key of the extraction cache (every page range)
+# the unstemmed forms of the terms are counted for the autocomplete (it suggests words, not stems)
+def process_task(task):
+    filepath, first_page, last_page = task
+    t = time.perf_counter()
+    content_hash = None
+    if first_page in (None, 1) or worker_cache:
+        try:
+            content_hash = file_hash(filepath)
+        except Exception:
+            content_hash = None
+    cache_key = ExtractionCache.key(content_hash, extractor_version, first_page, last_page) if content_hash else None
+    docs, cached, error = process_file(filepath, first_page, last_page, cache_key)
+    return {
+        "path": filepath,
+        "first_page": first_page,
+        "last_page": last_page,
+        "hash": content_hash if first_page in (None, 1) else None,
+        "docs": docs,
+        "cache_key": cache_key,
+        "cached": cached,
+        "error": error,
+        "surface_forms": count_surface_forms(content_analyzer(), [doc["content"] for doc in docs or []]),
+        "seconds": time.perf_counter() - t
+    }
+
+# Function to write one line of the extraction report and add the task to the statistics per file type
+def report_task(report, type_stats, result):
+    file_type = os.path.splitext(result["path"])[1].lower()
+    try:
+        size = os.path.getsize(result["path"]) if result["first_page"] in (None, 1) else 0
+    except OSError:
+        size = 0
+    docs = result["docs"] or []
+    chars = sum(len(doc["content"]) for doc in docs)
+    if result["error"]:
+        status = "error"
+    elif not chars:
+        status = "empty"
+    else:
+        status = "cached" if result["cached"] else "ok"
+    report.write(json.dumps({
+        "path": result["path"],
+        "first_page": result["first_page"],
+        "last_page": result["last_page"],
+        "file_type": file_type,
+        "status": status,
+        "seconds": round(result["seconds"], 4),
+        "bytes": size,
+        "pages": len(docs),
+        "chars": chars,
+        "error": result["error"]["stage"] if result["error"] else None
+    }) + "\n")
+
+    stats = type_stats.setdefault(file_type, {"tasks": 0, "errors": 0, "seconds": 0.0, "bytes": 0, "pages": 0})
+    stats["tasks"] += 1
+    stats["errors"] += status == "error"
+    stats["seconds"] += result["seconds"]
+    stats["bytes"] += size
+    stats["pages"] += len(docs)
+
+# Function to print the throughput per file type (worker time, the workers run in parallel)
+def print_type_summary(type_stats, duration):
+    print(f"\n{'type':<8}| {'tasks':>6} | {'errors':>6} | {'pages':>7} | {'MB':>8} | {'worker [s]':>10} | {'pages/s':>8} | {'MB/s':>7}")
+    for file_type, stats in sorted(type_stats.items(), key=lambda item: item[1]["seconds"], reverse=True):
+        seconds = max(stats["seconds"], 1e-9)
+        print(f"{file_type:<8}| {stats['tasks']:>6} | {stats['errors']:>6} | {stats['pages']:>7} | {stats['bytes'] / 1e6:>8.1f} | {stats['seconds']:>10.1f} | {stats['pages'] / seconds:>8.1f} | {stats['bytes'] / 1e6 / seconds:>7.2f}")
+    print(f"Wall time: {duration:.1f} s, see {report_file} in the index directory for the time of every file")
+
+# Function to count the pages of a PDF file in the main process, with a time limit (a corrupt file can hang the parser)
+# returns 0 if the file can not be read in time, it is then processed as a whole by a worker (with its own time limit)
+# a parser that hangs keeps running in its daemon thread until the end of the run
+def count_pdf_pages(filepath, timeout=None):
+    def count():
+        from PyPDF2 import PdfReader # needed to count the pages
+        return len(PdfReader(filepath).pages)
+    try:
+        return filepath, with_time_limit(timeout, count, threaded=True)
+    except (Exception, ExtractionTimeout):
+        return filepath, 0
+
+# Generator to find the files to index, yields (filepath, size) while the directories are scanned
+# only supported file types are returned, include/exclude are glob patterns (e.g. "*.pdf", "*/archive/*", "~$*"),
+# exclude patterns also skip whole directories, max_file_mb skips larger files (None = no limit)
+# stats counts the skipped files ("unsupported", "excluded", "too_large")
+def scan_files(folders, include=None, exclude=None, max_file_mb=None, stats=None):
+    stats = stats if stats is not None else {}
+    for key in ("unsupported", "excluded", "too_large"):
+        stats.setdefault(key, 0)
+    max_bytes = max_file_mb * 1024 * 1024 if max_file_mb else None
+
+    def excluded(entry):
+        return exclude and any(fnmatch.fnmatch(entry.name, pattern) or fnmatch.fnmatch(entry.path, pattern) for pattern in exclude)
+
+    # directories still to scan, depth first like os.walk (no recursion limit on deep trees)
+    pending = list(reversed(folders))
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except OSError as e:
+            log_error(getattr(e, "filename", None) or "Unknown", "Directory scan failed: " + str(e))
+            continue
+        subdirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if excluded(entry):
+                        stats["excluded"] += 1
+                    else:
+                        subdirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in supported_filetypes:
+                    stats["unsupported"] += 1
+                    continue
+                if excluded(entry) or (include and not any(fnmatch.fnmatch(entry.name, pattern) or fnmatch.fnmatch(entry.path, pattern) for pattern in include)):
+                    stats["excluded"] += 1
+                    continue
+                size = entry.stat().st_size
+            except OSError as e:
+                log_error(entry.path, "Metadata extraction failed: " + str(e))
+                continue
+            if max_bytes and size > max_bytes:
+                stats["too_large"] += 1
+                continue
+            yield entry.path, size
+        pending.extend(reversed(subdirs))
+
+# Generator to split the files into tasks, yields them largest first within a window of plan_window tasks
+# large PDFs are split into page ranges, so a single long file does not hold up the end of the run
+# counted["tasks"] is the number of tasks planned so far (the total is only known at the end of the scan)
+# timeout: seconds the page count of a PDF may take (None or 0 = no limit)
+def plan_tasks(files_to_process, counted=None, timeout=file_timeout):
+    counted = counted if counted is not None else {}
+    counted["tasks"] = 0
+    window = []
+    for filepath, size in files_to_process:
+        pages = 0
+        if filepath.lower().endswith(".pdf") and size >= pdf_split_min_mb * 1024 * 1024:
+            pages = count_pdf_pages(filepath, timeout)[1]
+        if pages > pdf_pages_per_task:
+            tasks = []
+            for first_page in range(1, pages + 1, pdf_pages_per_task):
+                last_page = min(first_page + pdf_pages_per_task - 1, pages)
+                # estimated work of a page range: its share of the file size
+                tasks.append((size * (last_page - first_page + 1) / pages, (filepath, first_page, last_page)))
+        else:
+            tasks = [(size, (filepath, None, None))]
+        for work, task in tasks:
+            # the counter keeps the order of equal sizes
+            heapq.heappush(window, (-work, counted["tasks"], task))
+            counted["tasks"] += 1
+        # largest first: long tasks start early and the small ones fill the gaps at the end of the run
+        while len(window) > plan_window:
+            yield heapq.heappop(window)[2]
+    while window:
+        yield heapq.heappop(window)[2]
 
+# Function to define the scheme of the Whoosh index
+# content_store=True: the page text is not stored in the index, it is kept in a compressed store next to it
+def create_schema(content_store=False):
     ### WHOOSH SYNTAX ### https://whoosh.readthedocs.io/en/latest/index.html
     # combine stopwords for both languages
     combined_stopwords = set(english_stopwords + german_stopwords)
@@ -173,38 +422,302 @@ def process_files_parallel(folders_to_index, index_dir):
     analyzer = StemmingAnalyzer() | StopFilter(stoplist=combined_stopwords)
 
     # Define scheme for Whoosh index, can be extended with more metadata fields if needed
-    schema = Schema(
-        file_name=TEXT(stored=True),
-        path=TEXT(stored=True),
-        author=TEXT(stored=True),
-        create_date=TEXT(stored=True),
-        page=NUMERIC(stored=True),
-        content=TEXT(stored=True, analyzer=analyzer) # text content gets stemmed and stopwords removed by whoosh analyzer
+    return Schema(
+        file_name=TEXT(stored=True), # words of the file name can be searched (file_name:...) and are suggested by the autocomplete
+        path=ID(stored=True, sortable=True), # not analyzed, so the pages of a file can be deleted by path, sortable to collapse search results by file
+        author=ID(stored=True, sortable=True), # not analyzed, the author list is read from the lexicon and used as filter
+        create_date=DATETIME(stored=True, sortable=True), # typed date for range filters, column for sorting by date
+        page=NUMERIC(stored=True, sortable=True), # column with the page numbers of the matching pages per file
+        content=TEXT(stored=not content_store, analyzer=analyzer) # text content gets stemmed and stopwords removed by whoosh analyzer
     )
 
-    # Create Whoosh index
+# Function to describe the fields of a schema, used to check if an index can be updated incrementally
+# (schemas with columns never compare equal in whoosh, the column objects have no equality)
+def schema_signature(schema):
+    return [(name, type(field).__name__, field.stored, field.column_type is not None) for name, field in schema.items()]
+
+# Function to compare the files on disk with the manifest of the last run
+# returns the files to (re-)extract, the removed files and the updated manifest
+def find_changed_files(files_on_disk, manifest):
+    changed_files = []
+    new_manifest = {}
+    for filepath in files_on_disk:
+        try:
+            stat = os.stat(filepath)
+        except OSError as e:
+            log_error(filepath, "Metadata extraction failed: " + str(e))
+            continue
+        entry = manifest.get(filepath)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            new_manifest[filepath] = entry
+            continue
+        # mtime or size changed: only re-extract if the content really changed (e.g. not only touched/copied)
+        if entry and entry["size"] == stat.st_size and entry["hash"] == file_hash(filepath):
+            new_manifest[filepath] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": entry["hash"]}
+            continue
+        changed_files.append(filepath)
+    seen_files = set(files_on_disk)
+    removed_files = [filepath for filepath in manifest if filepath not in seen_files]
+    return changed_files, removed_files, new_manifest
+
+# Function to create the result of a task that did not return from a worker
+def failed_result(task, stage, message):
+    filepath, first_page, last_page = task
+    return {"path": filepath, "first_page": first_page, "last_page": last_page, "hash": None, "docs": None,
+            "cache_key": None, "cached": False, "error": error_record(filepath, stage, message), "surface_forms": {}, "seconds": 0.0}
+
+# Generator to run the tasks in worker processes, yields the results as soon as a worker returns them
+# at most num_workers * 2 tasks are handed to the pool, so only few extracted files wait in RAM for the writer
+# the pool starts the tasks in order, so the first num_workers unfinished tasks are running: every running task has
+# a deadline of timeout + 60 seconds (no check without timeout). If a task passes it (e.g. a worker hangs in C code
+# or was killed), the pool is restarted: the overdue tasks are run once more and skipped with an error if they
+# stall again, the other unfinished tasks are handed to the new pool
+def run_tasks(tasks, num_workers, cache_path, timeout=file_timeout, memory_mb=file_memory_mb, max_tasks=tasks_per_worker):
+    stall_timeout = timeout + 60 if timeout else None
+    def start_pool():
+        # workers are replaced after max_tasks tasks (memory of large parses is returned to the system)
+        return Pool(num_workers, initializer=init_worker, initargs=(cache_path, timeout, memory_mb), maxtasksperchild=max_tasks or None)
+    done = queue.Queue()
+    # unfinished tasks in the order they were handed to the pool -> time they started (None = waiting for a worker)
+    in_flight = {}
+    retries = []
+    retried = set()
+    tasks = iter(tasks)
+    pool = start_pool()
+    try:
+        while True:
+            while len(in_flight) < num_workers * 2:
+                task = retries.pop() if retries else next(tasks, None)
+                if task is None:
+                    break
+                in_flight[task] = None
+                pool.apply_async(process_task, (task,), callback=done.put,
+                                 error_callback=lambda e, task=task: done.put(failed_result(task, "worker", repr(e))))
+            if not in_flight:
+                break
+            now = time.monotonic()
+            for task in list(in_flight)[:num_workers]:
+                if in_flight[task] is None:
+                    in_flight[task] = now
+            # wait until the oldest running task passes its deadline
+            wait = max(0.0, min(started for started in in_flight.values() if started is not None) + stall_timeout - now) if stall_timeout else None
+            try:
+                results = [done.get(timeout=wait)]
+            except queue.Empty:
+                # results that arrived while the pool is stopped are still used
+                pool.terminate()
+                results = []
+                while not done.empty():
+                    results.append(done.get())
+                for result in results:
+                    in_flight.pop((result["path"], result["first_page"], result["last_page"]), None)
+                now = time.monotonic()
+                for task, started in in_flight.items():
+                    if started is None or now - started < stall_timeout:
+                        retries.append(task)
+                    elif task in retried:
+                        results.append(failed_result(task, "stalled", f"No worker result for {stall_timeout} s, the task was skipped."))
+                    else:
+                        retried.add(task)
+                        retries.append(task)
+                in_flight = {}
+                pool = start_pool()
+            for result in results:
+                in_flight.pop((result["path"], result["first_page"], result["last_page"]), None)
+                yield result
+    finally:
+        pool.terminate()
+
+# Function to write one page to the index, returns the size of the written text
+def write_document(writer, doc):
+    try:
+        # ignore documents without content and create error log entry
+        if not doc.get("content"):
+            log_error(doc.get("path", "Unknown"), "Document content is empty. Skipping.")
+            return 0
+        writer.add_document(**doc)
+        return len(doc["content"])
+    except Exception as e:
+        log_error(doc.get("path", "Unknown"), str(e))
+        return 0
+
+# Function to open an index writer
+# with writer_procs > 1 tokenizing, stemming and posting writes run in sub-processes (each writes its own segment),
+# the segments are merged into one when the writer is committed
+def open_writer(ix, writer_procs=1, memory_mb=128):
+    if writer_procs > 1:
+        return ix.writer(procs=writer_procs, limitmb=memory_mb, multisegment=False)
+    return ix.writer(limitmb=memory_mb)
+
+# Main function to process files in parallel
+# with incremental=True only new or changed files are extracted and the existing index is updated in place
+# batch_mb: amount of extracted text written per commit, memory_mb: RAM limit of the whoosh writer (per writer process)
+# writer_procs: number of processes that analyze and write documents (1 = single writer in this process)
+# cache_path: extraction cache (None = extract everything again), cache_max_mb: cache size after the run
+# content_store: keep the page text in a compressed store (content_store.sqlite) instead of the index
+# include, exclude, max_file_mb: rules of the directory scan (see scan_files), excluded files are removed from an existing index
+# timeout, worker_memory_mb: time and memory limit of an extraction (0 = no limit), worker_tasks: tasks before a worker is replaced
+# embedding_model: compute page embeddings for the semantic search with this model (None = no embeddings)
+def process_files_parallel(folders_to_index, index_dir, incremental=False, batch_mb=256, memory_mb=128, writer_procs=1, cache_path=None, cache_max_mb=2048, content_store=False, include=None, exclude=None, max_file_mb=None, timeout=file_timeout, worker_memory_mb=file_memory_mb, worker_tasks=tasks_per_worker, embedding_model=None):
+    t = time.time()
+    # errors of an earlier run in the same process
+    error_logs.clear()
+    unsupported_files.clear()
+    # the files are scanned while the workers already extract the first ones
+    scan_stats = {}
+    files_on_disk = scan_files(folders_to_index, include, exclude, max_file_mb, scan_stats)
+
+    schema = create_schema(content_store)
+    if embedding_model:
+        # needs numpy and sentence-transformers, only imported when embeddings are computed
+        from semantic_search import EmbeddingWriter, has_embeddings
+
+    # Create Whoosh index or open the existing one for an incremental update
     if not os.path.exists(index_dir):
         os.mkdir(index_dir)
-    ix = create_in(index_dir, schema)
-
-    results = []
-    # iterate through document database and process parallelized
-    with Pool(num_workers) as pool:
-        for result in tqdm(pool.imap_unordered(process_file, files_to_process), total=len(files_to_process), desc="Indexing Files", dynamic_ncols=True):
-            if result:
-                results.extend(result)
-
-    # Write results to Whoosh index
-    with ix.writer() as writer:
-        for doc in results:
-            try:
-                # ignore documents without content and create error log entry
-                if not doc.get("content"):
-                    log_error(doc.get("path", "Unknown"), "Document content is empty. Skipping.")
-                    continue
-                writer.add_document(**doc)
-            except Exception as e:
-                log_error(doc.get("path", "Unknown"), str(e))
+    manifest = load_manifest(index_dir) if incremental else {}
+    if incremental and manifest and exists_in(index_dir) and schema_signature(open_dir(index_dir).schema) == schema_signature(schema) \
+            and (not embedding_model or has_embeddings(index_dir, embedding_model)):
+        ix = open_dir(index_dir)
+        update_in_place = True
+        # the removed files are only known after a complete scan
+        sizes = dict(files_on_disk)
+        changed_files, removed_files, manifest = find_changed_files(list(sizes), manifest)
+        files_to_process = [(filepath, sizes[filepath]) for filepath in changed_files]
+        print(f"Incremental update: {len(files_to_process)} new or changed files, {len(removed_files)} removed files")
+    else:
+        if incremental:
+            print("No compatible index or manifest found, creating a new index...")
+        # the manifest of the old index is removed before the first commit: the batches are committed one by one,
+        # an interrupted rebuild must not look complete to the next incremental run
+        # the pages and embeddings of the old index are not needed anymore
+        for filename in (manifest_file, CONTENT_STORE_FILE, SURFACE_FORMS_FILE, "embeddings.npy", "embeddings.json"):
+            if os.path.exists(os.path.join(index_dir, filename)):
+                os.remove(os.path.join(index_dir, filename))
+        # create_in writes an empty generation: the web apps keep the old index until the run is finished
+        write_index_state(index_dir, None)
+        ix = create_in(index_dir, schema)
+        update_in_place = False
+        files_to_process, removed_files, manifest = files_on_disk, [], {}
+    unchanged = update_in_place and not removed_files and not files_to_process
+    if update_in_place and not unchanged:
+        # the batches are committed one by one, the web apps keep the old generation until the run is finished
+        write_index_state(index_dir, None)
+    # unstemmed forms of the content terms, an update adds the counts of the new pages to the saved ones
+    surface_forms = load_surface_forms(index_dir) if update_in_place else {}
+    store = ContentStore(os.path.join(index_dir, CONTENT_STORE_FILE)) if content_store else None
+    embeddings = EmbeddingWriter(index_dir, embedding_model, incremental=update_in_place) if embedding_model else None
+
+    # defines amount of used processors for parallelizing (max - 2), adjust if needed
+    num_workers = max(1, cpu_count() - 2)
+    print(f"Processing files using {num_workers} workers and {writer_procs} writer processes...")
+
+    batch_bytes = 0
+    cache = ExtractionCache(cache_path) if cache_path else None
+    cache_hits = []
+    type_stats = {}
+    report = open(os.path.join(index_dir, report_file), "w", encoding="utf-8")
+    # limitmb bounds the RAM of the whoosh posting buffer, larger batches are spilled to temporary files
+    writer = open_writer(ix, writer_procs, memory_mb)
+    try:
+        # remove the pages of deleted and changed files before adding the new ones
+        # (a new index has nothing to remove, its files_to_process is the scan generator and must not be consumed here)
+        if update_in_place:
+            for filepath in removed_files + [filepath for filepath, _ in files_to_process]:
+                writer.delete_by_term("path", filepath)
+                if store:
+                    store.delete(filepath)
+                if embeddings:
+                    embeddings.delete(filepath)
+
+        # iterate through document database and process parallelized, documents are written as soon as a worker returns them
+        counted = {"tasks": 0}
+        # files with a failed task (e.g. one page range of a PDF) are not recorded in the manifest and retried by the next incremental run
+        failed_files = set()
+        tasks = plan_tasks(files_to_process, counted, timeout)
+        progress = tqdm(run_tasks(tasks, num_workers, cache_path, timeout, worker_memory_mb, worker_tasks), desc="Indexing Files", dynamic_ncols=True)
+        for result in progress:
+            # the total grows while the directories are scanned
+            progress.total = counted["tasks"]
+            if result["error"]:
+                log_error(result["path"], result["error"]["message"])
+                failed_files.add(result["path"])
+            report_task(report, type_stats, result)
+            add_surface_forms(surface_forms, result["surface_forms"])
+            if result["hash"] and not result["error"]:
+                stat = os.stat(result["path"])
+                manifest[result["path"]] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": result["hash"]}
+            # workers only read the cache, new extractions are stored by the main process
+            if cache and result["cache_key"] and result["docs"] is not None:
+                if result["cached"]:
+                    cache_hits.append(result["cache_key"])
+                else:
+                    cache.put(result["cache_key"], result["docs"][0]["author"] if result["docs"] else "Unknown", [(doc["page"], doc["content"]) for doc in result["docs"]])
+            for doc in result["docs"] or []:
+                written = write_document(writer, doc)
+                if store and written:
+                    store.put(doc["path"], doc["page"], doc["content"])
+                if embeddings and written:
+                    embeddings.add(doc["path"], doc["page"], doc["content"])
+                batch_bytes += written
+
+            # commit in bounded batches, so the amount of uncommitted data does not grow with the corpus
+            if batch_bytes >= batch_mb * 1024 * 1024:
+                if cache:
+                    cache.commit()
+                if store:
+                    store.commit()
+                writer.commit()
+                writer = open_writer(ix, writer_procs, memory_mb)
+                batch_bytes = 0
+        for filepath in failed_files:
+            manifest.pop(filepath, None)
+        if store:
+            store.commit()
+        # an incremental run without new, changed or removed files keeps the index generation
+        # (a commit would make the web apps reload the index and rebuild statistics and autocomplete terms)
+        if unchanged:
+            writer.cancel()
+            if embeddings:
+                embeddings.cancel()
+        else:
+            # pages without embeddings are not found by the semantic search, embeddings of removed pages are ignored
+            if embeddings:
+                embeddings.finish()
+            # saved before the last commit, so the autocomplete terms of the new generation use them
+            save_surface_forms(index_dir, surface_forms)
+            writer.commit()
+    except BaseException:
+        writer.cancel()
+        if embeddings:
+            embeddings.cancel()
+        raise
+    finally:
+        report.close()
+        if store:
+            store.close()
+        if cache:
+            cache.touch(cache_hits)
+            cache.commit()
+            print(f"Extraction cache: {len(cache_hits)} tasks served from cache")
+            # size-based eviction of the least recently used entries
+            cache.prune(cache_max_mb)
+            cache.close()
+
+    print(f"Skipped files: {scan_stats['unsupported']} unsupported, {scan_stats['excluded']} excluded, {scan_stats['too_large']} too large")
+    print_type_summary(type_stats, time.time() - t)
+
+    # save manifest only after the index has been committed
+    save_manifest(index_dir, manifest)
+    if unchanged:
+        print("No changes, the index was not modified")
+    else:
+        # precompute the field statistics for the search engine, so the first search does not need a lexicon scan
+        load_field_stats(ix)
+        # prebuild the sorted term array for the autocomplete of the search engine
+        load_term_index(ix)
+        # the web apps load the new generation now (statistics and autocomplete terms are ready)
+        write_index_state(index_dir, ix.latest_generation())
 
     # Write error logs, change error file name if needed
     with open(os.path.join(index_dir, "error_log.txt"), "w", encoding="utf-8") as f:
@@ -212,6 +725,8 @@ def process_files_parallel(folders_to_index, index_dir):
 
 # Select multiple directories with documents manually
 def select_multiple_directories():
+    import tkinter as tk # needed for GUI-interface to select files
+    from tkinter import filedialog, messagebox # needed for GUI-interface to select files
     root = tk.Tk()
     root.withdraw()
     folders = []
@@ -220,27 +735,71 @@ def select_multiple_directories():
         if not folder_path:
             break
         folders.append(folder_path)
-        add_more = tk.messagebox.askyesno("Add More Folders?", "Do you want to add another folder?")
+        add_more = messagebox.askyesno("Add More Folders?", "Do you want to add another folder?")
         if not add_more:
             break
+    root.destroy()
     return folders
 
+# Select the folder to save the index manually
+def select_output_directory():
+    import tkinter as tk # needed for GUI-interface to select files
+    from tkinter import filedialog # needed for GUI-interface to select files
+    root = tk.Tk()
+    root.withdraw()
+    output_dir = filedialog.askdirectory(title="Select a Folder to Save the Index")
+    root.destroy()
+    return output_dir
+
 # Main program
 if __name__ == "__main__":
-    # get folders to index
-    folders_to_index = select_multiple_directories()
+    # command line options
+    arg_parser = argparse.ArgumentParser(description="Index directories into a Whoosh index.")
+    arg_parser.add_argument("folders", nargs="*", help="folders to index (without folders a dialog asks for them)")
+    arg_parser.add_argument("--output", help="folder to save the index (without this option a dialog asks for it)")
+    arg_parser.add_argument("--incremental", action="store_true", help="only re-extract new or changed files and update the existing index")
+    arg_parser.add_argument("--batch-mb", type=int, default=256, help="amount of extracted text (MB) written to the index per commit")
+    arg_parser.add_argument("--memory-mb", type=int, default=128, help="RAM limit (MB) of the index writer before it spills to temporary files")
+    arg_parser.add_argument("--writer-procs", type=int, default=1, help="number of processes that analyze and write documents into separate segments (merged at the end)")
+    arg_parser.add_argument("--cache", default="extraction_cache.sqlite", help="file of the extraction cache (text is reused for unchanged files)")
+    arg_parser.add_argument("--no-cache", action="store_true", help="bypass the extraction cache and extract every file again")
+    arg_parser.add_argument("--cache-max-mb", type=int, default=2048, help="maximum size of the extraction cache, least recently used entries are evicted")
+    arg_parser.add_argument("--content-store", action="store_true", help="keep the page text in a compressed store next to the index instead of storing it in the index (smaller index)")
+    arg_parser.add_argument("--include", action="append", help="only index files matching this glob pattern (name or path, can be repeated)")
+    arg_parser.add_argument("--exclude", action="append", help="skip files and directories matching this glob pattern (name or path, can be repeated)")
+    arg_parser.add_argument("--max-file-mb", type=float, help="skip files larger than this size (MB)")
+    arg_parser.add_argument("--timeout", type=int, default=file_timeout, help="seconds an extraction may take before the file is skipped (0 = no limit)")
+    arg_parser.add_argument("--worker-memory-mb", type=int, default=file_memory_mb, help="memory (MB) a worker may allocate for one file before it is skipped, Linux only (0 = no limit)")
+    arg_parser.add_argument("--tasks-per-worker", type=int, default=tasks_per_worker, help="worker processes are replaced after this many tasks (0 = never)")
+    arg_parser.add_argument("--embeddings", action="store_true", help="compute page embeddings for the semantic search (needs pip install sentence-transformers)")
+    arg_parser.add_argument("--embedding-model", default="paraphrase-multilingual-MiniLM-L12-v2", help="sentence-transformers model (name or path of a local model) for --embeddings")
+    arg_parser.add_argument("--prune-cache", action="store_true", help="only prune the extraction cache to --cache-max-mb (0 clears it) and exit")
+    args = arg_parser.parse_args()
+
+    if args.prune_cache:
+        cache = ExtractionCache(args.cache)
+        print(f"Removed {cache.prune(args.cache_max_mb)} entries, cache size: {round(cache.size_mb(), 1)} MB")
+        cache.close()
+        exit()
+
+    # get folders to index (dialogs only if the folders are not given on the command line)
+    try:
+        folders_to_index = args.folders or select_multiple_directories()
+        # get folder to save the index (same path as configured in search function)
+        output_dir = (args.output or select_output_directory()) if folders_to_index else None
+    except Exception as e:
+        # no tkinter or no display (e.g. on a server)
+        arg_parser.error(f"no folder dialog available ({e}), pass the folders and --output on the command line")
     if not folders_to_index:
         print("No folders selected for indexing. Exiting.")
         exit()
     else:
-        # get folder to save the index (same path as configured in search function)
-        output_dir = filedialog.askdirectory(title="Select a Folder to Save the Index")
         if not output_dir:
             print("No folder selected for saving the index. Exiting.")
         else:
             t = time.time()
             # call processing function
-            process_files_parallel(folders_to_index, output_dir)
+            process_files_parallel(folders_to_index, output_dir, incremental=args.incremental, batch_mb=args.batch_mb, memory_mb=args.memory_mb, writer_procs=args.writer_procs, cache_path=None if args.no_cache else args.cache, cache_max_mb=args.cache_max_mb, content_store=args.content_store, include=args.include, exclude=args.exclude, max_file_mb=args.max_file_mb, timeout=args.timeout, worker_memory_mb=args.worker_memory_mb, worker_tasks=args.tasks_per_worker, embedding_model=args.embedding_model if args.embeddings else None)
 
             print("Indexing complete.")
             print(f"Index saved to: {output_dir}")
@@ -0,0 +1,78 @@
+import os # needed to interact with the operating system
+import time # needed to track when an entry was used last
+import json # needed to serialize extracted pages
+import zlib # needed to compress extracted text
+import sqlite3 # needed to store the cache on disk
+
+# On-disk cache for extracted text, keyed by file hash + extractor version + page range
+# the cache stores only the extracted text (and the author), metadata like path or date is read from the file again,
+# so moved or copied files are served from the cache as well
+class ExtractionCache:
+    def __init__(self, cache_path, readonly=False):
+        self.cache_path = cache_path
+        if readonly:
+            # workers only read, all writes are done by the main process
+            self.db = sqlite3.connect(f"file:{cache_path}?mode=ro", uri=True)
+        else:
+            self.db = sqlite3.connect(cache_path)
+            # WAL mode lets the workers read while the main process writes
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            self.db.commit()
+
+    # build the cache key of a file (or a page range of a PDF file)
+    @staticmethod
+    def key(content_hash, extractor_version, first_page=None, last_page=None):
+        return f"{content_hash}:{extractor_version}:{first_page or ''}-{last_page or ''}"
+
+    # returns (author, [(page, text), ...]) or None
+    def get(self, key):
+        row = self.db.execute("SELECT data FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        author, pages = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+        return author, [tuple(page) for page in pages]
+
+    def put(self, key, author, pages):
+        data = zlib.compress(json.dumps([author, pages]).encode("utf-8"))
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, data, len(data), time.time()))
+
+    # mark entries as used, so they are evicted last
+    def touch(self, keys):
+        now = time.time()
+        self.db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in keys])
+
+    def commit(self):
+        self.db.commit()
+
+    # size of all cached entries in MB
+    def size_mb(self):
+        return (self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]) / (1024 * 1024)
+
+    # evict the least recently used entries until the cache is smaller than max_mb, returns the number of removed entries
+    def prune(self, max_mb):
+        max_bytes = max_mb * 1024 * 1024
+        total = self.size_mb() * 1024 * 1024
+        removed = 0
+        rows = self.db.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if total <= max_bytes:
+                break
+            self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        self.db.commit()
+        if removed:
+            # give the freed space back to the file system
+            self.db.execute("VACUUM")
+        return removed
+
+    def close(self):
+        self.db.close()
+
+# Function to open the cache only if it exists (workers must not create it)
+def open_readonly(cache_path):
+    if cache_path and os.path.exists(cache_path):
+        return ExtractionCache(cache_path, readonly=True)
+    return None
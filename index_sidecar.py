@@ -0,0 +1,41 @@
+import os # needed to build the paths and replace the files
+import json # needed to read and write the files
+import threading # needed for the name of the temporary file
+
+# Write a JSON file next to the index, a temporary file (one per process and thread) is written first,
+# so a reader never sees a half-written file (indexer and web apps write the same files)
+def write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+# Load data stored alongside the index (e.g. field statistics, autocomplete terms), rebuilt once per index generation
+# build: function returning the data as a dict, it is stored together with the generation
+def load_sidecar(ix, filename, build):
+    path = os.path.join(ix.storage.folder, filename)
+    generation = ix.latest_generation()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("generation") == generation:
+            return stored
+
+    stored = dict(build(), generation=generation)
+    write_json(path, stored)
+    return stored
+
+# File (inside the index directory) with the generation of the last finished indexer run, null while a run writes the index
+# (the indexer commits in batches, the web apps only reload finished generations)
+INDEX_STATE_FILE = "index_state.json"
+
+def write_index_state(index_dir, generation):
+    write_json(os.path.join(index_dir, INDEX_STATE_FILE), {"generation": generation})
+
+# state of the index directory, None if the index was not written by the indexer (no state file)
+def read_index_state(index_dir):
+    path = os.path.join(index_dir, INDEX_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,68 @@
+import time # needed to measure latency and throughput
+import json # needed to read the API responses
+import argparse # needed to read command line options
+import urllib.request # needed to send the requests (no extra library needed)
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor # needed to send concurrent requests
+
+# Function to send one query to the JSON search API, returns latency (ms), cache hit and error message
+def send_query(url, query, top_k):
+    data = urllib.parse.urlencode({"q": query, "top_k": top_k}).encode("utf-8")
+    t = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, data=data, timeout=60) as response:
+            body = json.load(response)
+    except Exception as e:
+        return (time.perf_counter() - t) * 1000, False, str(e)
+    if body.get("status") != "success":
+        return (time.perf_counter() - t) * 1000, False, body.get("message", "error")
+    return (time.perf_counter() - t) * 1000, body["metrics"].get("cache_hit", False), None
+
+# Function to read a value of a sorted list at a percentile
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+# Function to send the queries with several concurrent clients and print latency percentiles and QPS
+def run_load_test(url, queries, concurrency=8, num_requests=500, top_k=10):
+    jobs = [queries[i % len(queries)] for i in range(num_requests)]
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rows = list(pool.map(lambda query: send_query(url, query, top_k), jobs))
+    duration = time.perf_counter() - t
+
+    latencies = sorted(latency for latency, _, error in rows if error is None)
+    errors = [error for _, _, error in rows if error is not None]
+    cache_hits = sum(1 for _, cache_hit, error in rows if cache_hit and error is None)
+
+    print(f"\n=== Load test {url} ({concurrency} clients, {num_requests} requests, {len(queries)} different queries) ===")
+    if latencies:
+        print(f"p50: {percentile(latencies, 50):.1f} ms, p95: {percentile(latencies, 95):.1f} ms, p99: {percentile(latencies, 99):.1f} ms")
+    print(f"QPS: {len(latencies) / duration:.1f}, duration: {duration:.1f} s")
+    print(f"Cache hits: {cache_hits} of {len(latencies)}, errors: {len(errors)}")
+    for error in sorted(set(errors))[:5]:
+        print(f"  {error}")
+    return latencies, duration, errors
+
+# Main program
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Load test for the JSON search API of whoosh_search.py.")
+    arg_parser.add_argument("--url", default="http://127.0.0.1:5000/api/search", help="URL of the search API")
+    arg_parser.add_argument("--queries", help="file with one query per line")
+    arg_parser.add_argument("--index", help="index to sample queries from (if no query file is given)")
+    arg_parser.add_argument("--num-queries", type=int, default=100, help="number of sampled queries")
+    arg_parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    arg_parser.add_argument("--requests", type=int, default=500, help="total number of requests")
+    arg_parser.add_argument("--top-k", type=int, default=10, help="results per request")
+    args = arg_parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    elif args.index:
+        from whoosh.index import open_dir
+        from benchmark import sample_queries
+        queries = sample_queries(open_dir(args.index), args.num_queries)
+    else:
+        arg_parser.error("either --queries or --index is needed")
+
+    run_load_test(args.url, queries, args.concurrency, args.requests, args.top_k)
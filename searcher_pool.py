@@ -0,0 +1,87 @@
+import threading # needed to share the pool between the request threads of the web apps
+from contextlib import contextmanager
+from whoosh import scoring
+from whoosh.index import FileIndex
+from whoosh.searching import Searcher
+
+# Pool of long-lived searchers shared by the requests of a web app
+# opening a searcher opens the segment files of the index, the pool keeps them open and only
+# reopens changed segments (searcher.refresh()) when the index has a new generation
+# whoosh searchers are not thread-safe, every request borrows its own searcher
+class SearcherPool:
+    def __init__(self, ix, max_idle=4):
+        self.ix = ix
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+        # closed pools (replaced by a new index) close the searchers of the running requests when they are returned
+        self.closed = False
+
+    # borrow a searcher with the given weighting (default BM25F), it goes back to the pool afterwards
+    @contextmanager
+    def searcher(self, weighting=None):
+        with self.lock:
+            searcher = self.idle.pop() if self.idle else None
+        if searcher is None:
+            searcher = self.ix.searcher()
+        else:
+            # returns the same searcher if the index has not changed
+            searcher = searcher.refresh()
+        # the weighting (e.g. the custom score with the current settings) is chosen per request
+        weighting = weighting or scoring.BM25F()
+        for subsearcher, _ in searcher.leaf_searchers():
+            subsearcher.weighting = weighting
+        searcher.weighting = weighting
+        try:
+            yield searcher
+        finally:
+            with self.lock:
+                if not self.closed and len(self.idle) < self.max_idle:
+                    self.idle.append(searcher)
+                    searcher = None
+            if searcher is not None:
+                searcher.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            for searcher in self.idle:
+                searcher.close()
+            self.idle = []
+
+# Index pinned to the generation it was opened with (used by the web apps, see background_loader.py)
+# searchers, statistics and caches stay on this generation, searcher.refresh() returns the same searcher,
+# a new generation is only used by the next engine, which is opened, warmed up and swapped in by the loader
+class PinnedIndex:
+    def __init__(self, ix):
+        self.ix = ix
+        self.toc = ix._read_toc()
+        self.generation = self.toc.generation
+        # whoosh reads the schema from the table of contents on every access, the pinned one is read once
+        self.schema = self.toc.schema
+        # set when the files of the pinned generation are gone, the index is then read like an unpinned one
+        self.fallback = False
+
+    def latest_generation(self):
+        if self.fallback:
+            return self.ix.latest_generation()
+        return self.generation
+
+    def reader(self, reuse=None):
+        if self.fallback:
+            return self.ix.reader(reuse=reuse)
+        try:
+            # readers of the pinned generation are opened without reuse, a failed open would close the reused ones
+            return FileIndex._reader(self.ix.storage, self.schema, self.toc.segments, self.generation)
+        except IOError:
+            # a newer commit merged and removed segments of this generation (the open searchers keep their files),
+            # new searchers read the latest generation until the loader swaps in the new engine
+            self.fallback = True
+            return self.ix.reader()
+
+    def searcher(self, **kwargs):
+        return Searcher(self.reader(), fromindex=self, **kwargs)
+
+    # everything else (storage, indexname, writer, ...) from the index itself
+    def __getattr__(self, name):
+        return getattr(self.ix, name)
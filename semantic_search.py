@@ -0,0 +1,174 @@
+import os # needed to interact with the operating system
+import json # needed to store the keys of the embeddings
+import threading # needed to share the model and the matrix between the request threads of the web apps
+import numpy as np # needed for the embedding matrix and the similarity search
+
+# Files (inside the index directory) with the page embeddings (one row per page) and their (path, page) keys
+EMBEDDINGS_FILE = "embeddings.npy"
+EMBEDDINGS_KEYS_FILE = "embeddings.json"
+# local sentence-transformers model (name or path), German and English, 384 dimensions, runs on CPU
+DEFAULT_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+
+models = {}
+models_lock = threading.Lock()
+
+# Function to load a model once per process (needs pip install sentence-transformers)
+def load_model(model_name):
+    with models_lock:
+        if model_name not in models:
+            from sentence_transformers import SentenceTransformer
+            models[model_name] = SentenceTransformer(model_name, device="cpu")
+        return models[model_name]
+
+# Function to compute normalized embeddings (the dot product of two rows is their cosine similarity)
+def embed(model, texts, batch_size=32):
+    return np.asarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True), dtype=np.float32)
+
+# Function to read the keys file of an index, returns None if the index has no embeddings
+def load_keys(index_dir):
+    keys_path = os.path.join(index_dir, EMBEDDINGS_KEYS_FILE)
+    if not os.path.exists(keys_path) or not os.path.exists(os.path.join(index_dir, EMBEDDINGS_FILE)):
+        return None
+    with open(keys_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Function to check if the embeddings of an index were computed with a model (needed for incremental updates)
+def has_embeddings(index_dir, model_name=DEFAULT_MODEL):
+    stored = load_keys(index_dir)
+    return stored is not None and stored["model"] == model_name
+
+# Embeddings of the indexed pages, computed in batches while the pages are written to the index
+# the new rows are collected in a raw file and combined with the kept rows of the last run by finish()
+class EmbeddingWriter:
+    def __init__(self, index_dir, model_name=DEFAULT_MODEL, incremental=False, batch_size=64):
+        self.index_dir = index_dir
+        self.model_name = model_name
+        self.model = load_model(model_name)
+        self.batch_size = batch_size
+        self.pending = []
+        self.keys = []
+        self.dims = None
+        self.deleted = set()
+        self.rows_path = os.path.join(index_dir, EMBEDDINGS_FILE + ".rows")
+        self.rows = open(self.rows_path, "wb")
+        # rows of the unchanged files are taken over from the last run
+        self.old_keys = []
+        if incremental and has_embeddings(index_dir, model_name):
+            self.old_keys = load_keys(index_dir)["keys"]
+
+    def add(self, path, page, text):
+        self.pending.append((path, page, text))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    # remove the rows of a file (deleted or changed files)
+    def delete(self, path):
+        self.deleted.add(path)
+
+    def flush(self):
+        if not self.pending:
+            return
+        vectors = embed(self.model, [text for _, _, text in self.pending])
+        self.dims = vectors.shape[1]
+        self.rows.write(vectors.tobytes())
+        self.keys.extend([path, page] for path, page, _ in self.pending)
+        self.pending = []
+
+    # Function to write the matrix of the kept and the new rows, copied in chunks so the matrix is never fully in RAM
+    def finish(self, chunk_rows=65536):
+        self.flush()
+        self.rows.close()
+        matrix_path = os.path.join(self.index_dir, EMBEDDINGS_FILE)
+        keep = [i for i, (path, _) in enumerate(self.old_keys) if path not in self.deleted]
+        old = np.load(matrix_path, mmap_mode="r") if keep else None
+        dims = self.dims or (old.shape[1] if old is not None else self.model.get_sentence_embedding_dimension())
+        new = np.memmap(self.rows_path, dtype=np.float32, mode="r", shape=(len(self.keys), dims)) if self.keys else None
+
+        matrix = np.lib.format.open_memmap(matrix_path + ".tmp", mode="w+", dtype=np.float32, shape=(len(keep) + len(self.keys), dims))
+        for start in range(0, len(keep), chunk_rows):
+            rows = keep[start:start + chunk_rows]
+            matrix[start:start + len(rows)] = old[rows]
+        for start in range(0, len(self.keys), chunk_rows):
+            rows = new[start:start + chunk_rows]
+            matrix[len(keep) + start:len(keep) + start + len(rows)] = rows
+        matrix.flush()
+        del matrix, old, new
+
+        # the matrix is replaced first, the search only uses it together with keys of the same length
+        os.replace(matrix_path + ".tmp", matrix_path)
+        keys_path = os.path.join(self.index_dir, EMBEDDINGS_KEYS_FILE)
+        with open(keys_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "keys": [self.old_keys[i] for i in keep] + self.keys}, f)
+        os.replace(keys_path + ".tmp", keys_path)
+        os.remove(self.rows_path)
+
+    def cancel(self):
+        self.rows.close()
+        os.remove(self.rows_path)
+
+# Memory-mapped page embeddings of an index, answers queries with a matrix-vector product over chunks of rows
+# (exact nearest neighbours; only the pages of the matrix chunk in use are read from disk)
+# pinned: keep the embeddings loaded first (the web app swaps in a new engine for a new index)
+class SemanticIndex:
+    def __init__(self, index_dir, pinned=False):
+        self.index_dir = index_dir
+        self.pinned = pinned
+        self.lock = threading.Lock()
+        self.matrix = None
+        self.keys = []
+        self.model_name = None
+        self.loaded_mtime = None
+        self.refresh()
+
+    # reload the embeddings after the indexer wrote new ones
+    def refresh(self):
+        if self.pinned and self.matrix is not None:
+            return
+        keys_path = os.path.join(self.index_dir, EMBEDDINGS_KEYS_FILE)
+        try:
+            mtime = os.path.getmtime(keys_path)
+        except OSError:
+            return
+        if mtime == self.loaded_mtime:
+            return
+        stored = load_keys(self.index_dir)
+        matrix = np.load(os.path.join(self.index_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        # the indexer is just writing new embeddings, keep the old ones until matrix and keys match
+        if stored is None or matrix.shape[0] != len(stored["keys"]):
+            return
+        with self.lock:
+            self.matrix, self.keys, self.model_name, self.loaded_mtime = matrix, stored["keys"], stored["model"], mtime
+
+    # best pages for a query, returns a list of (similarity, path, page), the most similar first
+    def search(self, query, limit=50, chunk_rows=65536):
+        self.refresh()
+        with self.lock:
+            matrix, keys, model_name = self.matrix, self.keys, self.model_name
+        if matrix is None or not len(keys):
+            return []
+        vector = embed(load_model(model_name), [query])[0]
+        # only the best `limit` rows of every chunk are kept
+        scores, rows = [], []
+        for start in range(0, matrix.shape[0], chunk_rows):
+            chunk_scores = np.asarray(matrix[start:start + chunk_rows]) @ vector
+            best = np.argpartition(-chunk_scores, limit - 1)[:limit] if len(chunk_scores) > limit else np.arange(len(chunk_scores))
+            scores.append(chunk_scores[best])
+            rows.append(best + start)
+        scores, rows = np.concatenate(scores), np.concatenate(rows)
+        order = np.lexsort((rows, -scores))[:limit]
+        return [(float(scores[i]), keys[rows[i]][0], keys[rows[i]][1]) for i in order]
+
+# Function to open the embeddings of an index (None if the index was created without --embeddings)
+def open_semantic_index(index_dir, pinned=False):
+    if load_keys(index_dir) is None:
+        return None
+    return SemanticIndex(index_dir, pinned)
+
+# Reciprocal rank fusion of several ranked lists of keys, returns the keys with their fused score, the best first
+# k dampens the influence of the first ranks (60 as in the original RRF paper)
+def reciprocal_rank_fusion(rankings, k=60):
+    fused = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,169 @@
+import os # needed to interact with the operating system
+import json # needed to read and write the settings
+import time # needed to measure the tuning time
+import argparse # needed to read command line options
+import numpy as np # needed to score all weight combinations at once
+from whoosh.index import open_dir # needed to open the index
+from whoosh.qparser import QueryParser, OrGroup # needed to parse the judged queries
+from batch_scoring import BatchScoring # needed to read the postings in blocks and for the window scores
+from benchmark import load_judgments, ranked_files, ndcg, reciprocal_rank # same judgments file and measures as the benchmark
+
+# The custom score is linear in the three weights:
+# score = tf + idf_weight * idf + position_weight * position + proximity_weight * proximity (summed over the query terms)
+# the four sums are computed once per (query, page), every weight combination is then one matrix product
+weight_names = ["idf_weight", "position_weight", "proximity_weight"]
+
+# Function to compute the features of all pages matching a query (columns: tf, idf, position, proximity)
+# same formulas as CustomScoring.custom_score, window=True uses the window score as proximity (proximity_mode "window")
+def query_features(batch, searcher, q, window=False):
+    features = np.zeros((searcher.doc_count_all(), 4))
+    matched = np.zeros(searcher.doc_count_all(), dtype=bool)
+    for term in batch.query_terms(q):
+        idf = searcher.idf(term.fieldname, term.text)
+        # fields without positions (ID fields like author and path) have no position and proximity feature
+        if not searcher.schema[term.fieldname].supports("positions"):
+            for ids, freqs, _, _ in batch.posting_blocks(searcher, term.fieldname, term.text):
+                features[ids, 0] += freqs * term.boost
+                features[ids, 1] += idf * term.boost
+                matched[ids] = True
+            continue
+        lengths = batch.doc_lengths(searcher, term.fieldname)
+        for ids, freqs, firsts, lasts in batch.posting_blocks(searcher, term.fieldname, term.text):
+            position_scores = np.where(freqs > 0, 1.0 - firsts / lengths[ids], 0.0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                proximity_scores = np.where(freqs > 1, 1.0 / (1.0 + (lasts - firsts) / (freqs - 1)), 0.0)
+            features[ids, 0] += freqs * term.boost
+            features[ids, 1] += idf * term.boost
+            features[ids, 2] += position_scores * term.boost
+            if not window:
+                features[ids, 3] += proximity_scores * term.boost
+            matched[ids] = True
+    docnums = np.flatnonzero(matched)
+    if window and len(batch.query_terms(q)) > 1 and len(docnums):
+        features[docnums, 3] = batch.window_scores(searcher, q, docnums.tolist())
+    return docnums, features[docnums]
+
+# Function to prepare the judged queries: features of the matching pages, file of every page and gain of every file
+# (the result list of the web app shows the best page per file, the judgments are given per file name)
+def prepare_queries(ix, judged, window=False):
+    batch = BatchScoring({})
+    parser = QueryParser("content", ix.schema, group=OrGroup)
+    prepared, skipped = [], []
+    with ix.searcher() as searcher:
+        for entry in judged:
+            q = parser.parse(entry["query"])
+            if not BatchScoring.supports(q):
+                skipped.append(entry["query"])
+                continue
+            docnums, features = query_features(batch, searcher, q, window)
+            file_names = [searcher.stored_fields(docnum)["file_name"] for docnum in docnums.tolist()]
+            names, file_ids = np.unique(file_names, return_inverse=True)
+            # pages sorted by file, so the best page of every file is one reduceat
+            order = np.argsort(file_ids, kind="stable")
+            starts = np.flatnonzero(np.r_[True, np.diff(file_ids[order]) != 0]) if len(order) else np.array([], dtype=int)
+            gains = np.array([2 ** entry["judgments"].get(name, 0) - 1 for name in names], dtype=float)
+            ideal = sorted((2 ** grade - 1 for grade in entry["judgments"].values()), reverse=True)
+            prepared.append((features[order], starts, gains, ideal))
+    return prepared, skipped
+
+# Function to evaluate weight combinations (rows of idf, position, proximity weight)
+# returns the mean nDCG@k and MRR@k of every combination
+def evaluate(prepared, weights, k=10, max_cells=2 ** 24):
+    weights = np.asarray(weights, dtype=float)
+    coefficients = np.hstack([np.ones((len(weights), 1)), weights]).T
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    total_ndcg = np.zeros(len(weights))
+    total_rr = np.zeros(len(weights))
+    for features, starts, gains, ideal in prepared:
+        idcg = sum(gain * discount for gain, discount in zip(ideal[:k], discounts))
+        if not len(features) or not idcg:
+            continue
+        depth = min(k, len(gains))
+        # the combinations are scored in chunks, so pages x combinations stays below max_cells
+        chunk = max(1, max_cells // len(features))
+        for start in range(0, len(weights), chunk):
+            scores = features @ coefficients[:, start:start + chunk]
+            file_scores = np.maximum.reduceat(scores, starts, axis=0)
+            top = np.argpartition(-file_scores, depth - 1, axis=0)[:depth] if len(gains) > depth else np.tile(np.arange(len(gains))[:, None], (1, file_scores.shape[1]))
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(file_scores, top, axis=0), axis=0, kind="stable"), axis=0)
+            ranked_gains = gains[top]
+            total_ndcg[start:start + chunk] += (ranked_gains * discounts[:depth, None]).sum(axis=0) / idcg
+            relevant = ranked_gains > 0
+            total_rr[start:start + chunk] += np.where(relevant.any(axis=0), 1.0 / (relevant.argmax(axis=0) + 1), 0.0)
+    return total_ndcg / len(prepared), total_rr / len(prepared)
+
+# Function to check the best weights with real searches of the batch scorer (same ranking as the web app for OR queries)
+def verify(ix, judged, settings, window=False, k=10):
+    batch = BatchScoring(settings)
+    parser = QueryParser("content", ix.schema, group=OrGroup)
+    ndcg_sum, rr_sum = 0.0, 0.0
+
+    # searcher with the search() of the batch scorer, so ranked_files of the benchmark can be used
+    class BatchSearcher:
+        def __init__(self, searcher):
+            self.searcher = searcher
+
+        def search(self, q, limit=10):
+            return batch.search(self.searcher, q, limit=limit, window=window)
+
+    with ix.searcher() as searcher:
+        for entry in judged:
+            files = ranked_files(BatchSearcher(searcher), parser, entry["query"], k)
+            ndcg_sum += ndcg(files, entry["judgments"], k)
+            rr_sum += reciprocal_rank(files, entry["judgments"])
+    return ndcg_sum / len(judged), rr_sum / len(judged)
+
+# Main program
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Tune the scoring weights on judged queries.")
+    arg_parser.add_argument("--index", default=r".\whoosh_index", help="index directory")
+    arg_parser.add_argument("--judgments", required=True, help="judged queries, one JSON line per query (see benchmark.py)")
+    arg_parser.add_argument("--settings", default="settings.json", help="settings file of the web app (current weights, --save writes the best weights)")
+    arg_parser.add_argument("--grid", type=float, nargs=3, default=[0.0, 5.0, 0.25], metavar=("MIN", "MAX", "STEP"), help="values tried for every weight")
+    arg_parser.add_argument("--proximity-mode", choices=["phrase", "window"], help="proximity score to tune (default: proximity_mode of the settings)")
+    arg_parser.add_argument("--k", type=int, default=10, help="cut-off of nDCG and MRR")
+    arg_parser.add_argument("--save", action="store_true", help="write the best weights to the settings file")
+    args = arg_parser.parse_args()
+
+    settings = {"proximity_weight": 2.5, "position_weight": 1.5, "idf_weight": 1.2, "proximity_mode": "phrase"}
+    if os.path.exists(args.settings):
+        with open(args.settings, "r") as f:
+            settings.update(json.load(f))
+    window = (args.proximity_mode or settings["proximity_mode"]) == "window"
+
+    ix = open_dir(args.index)
+    judged = load_judgments(args.judgments)
+    t = time.perf_counter()
+    prepared, skipped = prepare_queries(ix, judged, window)
+    print(f"Features of {len(prepared)} queries computed in {time.perf_counter() - t:.2f} s")
+    for query in skipped:
+        print(f"  skipped (only terms are supported): {query}")
+    if not prepared:
+        raise SystemExit("No judged query can be tuned.")
+
+    low, high, step = args.grid
+    values = np.arange(low, high + step / 2, step)
+    grid = np.array(np.meshgrid(values, values, values, indexing="ij")).reshape(3, -1).T
+    current = [[settings[name] for name in weight_names]]
+    t = time.perf_counter()
+    ndcg_values, rr_values = evaluate(prepared, np.vstack([current, grid]), args.k)
+    duration = time.perf_counter() - t
+    print(f"{len(grid)} weight combinations evaluated in {duration:.2f} s ({len(grid) / duration:.0f} per second)")
+
+    # best nDCG first, then MRR, then the first combination of the grid (smallest weights)
+    order = np.lexsort((np.arange(len(grid)), -rr_values[1:], -ndcg_values[1:]))
+    print(f"\n{'idf':>6} | {'position':>8} | {'proximity':>9} | {f'nDCG@{args.k}':>7} | {'MRR':>6}")
+    print(f"{current[0][0]:>6.2f} | {current[0][1]:>8.2f} | {current[0][2]:>9.2f} | {ndcg_values[0]:>7.3f} | {rr_values[0]:>6.3f}   (current)")
+    for i in order[:10]:
+        idf_weight, position_weight, proximity_weight = grid[i]
+        print(f"{idf_weight:>6.2f} | {position_weight:>8.2f} | {proximity_weight:>9.2f} | {ndcg_values[i + 1]:>7.3f} | {rr_values[i + 1]:>6.3f}")
+
+    if (grid[order[0]] >= values[-1]).any() and high > low:
+        print("A best weight is at the upper end of the grid, a larger --grid MAX may find better weights")
+    best = dict(settings, **{name: round(float(value), 4) for name, value in zip(weight_names, grid[order[0]])})
+    checked_ndcg, checked_rr = verify(ix, [entry for entry in judged if entry["query"] not in skipped], best, window, args.k)
+    print(f"\nBest weights checked with the search: nDCG@{args.k} {checked_ndcg:.3f}, MRR {checked_rr:.3f}")
+    if args.save:
+        with open(args.settings, "w") as f:
+            json.dump(best, f)
+        print(f"Saved to {args.settings}")
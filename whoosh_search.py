@@ -1,8 +1,23 @@
 from flask import Flask, render_template, request, jsonify
+from werkzeug.serving import is_running_from_reloader
 from whoosh.index import open_dir
 from whoosh.qparser import QueryParser, OrGroup
-from whoosh.scoring import FunctionWeighting
-from whoosh import highlight
+from whoosh.searching import Results
+from whoosh.query import And, Or, Term, DateRange, Every
+from whoosh.fields import DATETIME
+from custom_scoring import CustomScoring, load_field_stats
+from searcher_pool import SearcherPool, PinnedIndex
+from autocomplete import load_term_index
+from content_store import open_store
+from background_loader import BackgroundLoader
+# batch_scoring and semantic_search need numpy, they are imported when the engine is opened (in the background)
+from whoosh import highlight, sorting, collectors
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+import argparse
+import html
+import re
+import threading
 import time
 import json
 import os
@@ -21,225 +36,710 @@ def load_settings():
     return {
         "proximity_weight": 2.5,
         "position_weight": 1.5,
-        "idf_weight": 1.2
+        "idf_weight": 1.2,
+        "proximity_mode": "phrase"
     }
 
 def save_settings(settings):
     with open(SETTINGS_FILE, "w") as f:
         json.dump(settings, f)
 
-# Custom scoring function
-class CustomScoring(FunctionWeighting):
-    def __init__(self, settings):
-        self.settings = settings
-        super().__init__(self.custom_score)
+# Date filters in the query: create_date:2024, create_date:2024-03, create_date:[2023-01 to 2023-06],
+# create_date:>2024-03-01 (after), create_date:<2024 (before)
+date_clause = re.compile(r"create_date:(\[[^\]]*\]|[<>]?\S+)")
 
-    def custom_score(self, searcher, fieldname, text, matcher):
-        # Get term frequency
-        term_freq = matcher.value_as("frequency")
-        
-        # Get IDF score
-        idf = searcher.idf(fieldname, text)
-        
-        # POSITION SCORING
-        # Get positions and calculate position score
-        positions = matcher.value_as("positions")
-        if positions:
-            # Normalize position score based on document length
-            doc_length = searcher.doc_field_length(matcher.id(), fieldname)
-            # Rate position based on how close it is to the beginning of the document
-            position_score = 1.0 - (min(positions) / doc_length)
-        else:
-            position_score = 0.0
-
-        # PROXIMITY SCORING
-        # Calculate proximity score based on term positions
-        if positions and len(positions) > 1:
-            # Calculate average distance between consecutive positions
-            distances = [positions[i+1] - positions[i] for i in range(len(positions)-1)]
-            avg_distance = sum(distances) / len(distances)
-            # Rate proximity based on average distance between terms
-            proximity_score = 1.0 / (1.0 + avg_distance)
+# first and last moment of a date given as YYYY, YYYY-MM or YYYY-MM-DD
+def date_bounds(text):
+    for fmt in ("%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            start = datetime.strptime(text.strip(), fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d":
+            end = start + timedelta(days=1)
+        elif fmt == "%Y-%m":
+            end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
         else:
-            proximity_score = 0.0
-
-        # Apply weights and combine scores
-        weighted_score = (
-            term_freq +
-            (self.settings["idf_weight"] * idf) +
-            (self.settings["position_weight"] * position_score) +
-            (self.settings["proximity_weight"] * proximity_score)
-        )
-
-        return weighted_score
-
-    # Dynamic max quality calculation, based on the maximum values of each scoring component
-    def max_quality(self, searcher, fieldname):
-        terms = searcher.field_terms(fieldname)
-        if not terms:
-            return 0.0
-
-        # Get maximum values for each scoring component
-        max_term_freq = max(terms.values(), default=1)
-        max_idf = max(searcher.idf(fieldname, term) for term in terms)
-        max_position_score = 1.0
-        max_proximity_score = 1.0
-
-        return (
-            max_term_freq +
-            (self.settings["idf_weight"] * max_idf) +
-            (self.settings["position_weight"] * max_position_score) +
-            (self.settings["proximity_weight"] * max_proximity_score)
-        )
+            end = start.replace(year=start.year + 1)
+        return start, end - timedelta(microseconds=1)
+    raise ValueError(f"Ungültiges Datum: {text}")
+
+# date range query of one create_date clause
+def parse_date_clause(value):
+    if value.startswith("["):
+        # "to" as in whoosh's range syntax, also written "TO", open ranges as [2021 to] or [to 2022]
+        lower, upper = (re.split(r"\s*\bto\b\s*", value[1:-1], maxsplit=1, flags=re.IGNORECASE) + [""])[:2]
+        start = date_bounds(lower)[0] if lower.strip() else None
+        end = date_bounds(upper)[1] if upper.strip() else None
+    elif value.startswith(">"):
+        start, end = date_bounds(value[1:])[1] + timedelta(microseconds=1), None
+    elif value.startswith("<"):
+        start, end = None, date_bounds(value[1:])[0] - timedelta(microseconds=1)
+    else:
+        start, end = date_bounds(value)
+    return DateRange("create_date", start, end)
+
+# Collector that only passes the pages matching a filter query to the collectors below it
+# (whoosh's filter=... wraps the collapse collector, the filtered pages would not be collapsed by file)
+class FilterMatchesCollector(collectors.WrappingCollector):
+    def __init__(self, child, filter_query):
+        collectors.WrappingCollector.__init__(self, child)
+        self.filter_query = filter_query
+
+    def prepare(self, top_searcher, q, context):
+        collectors.WrappingCollector.prepare(self, top_searcher, q, context)
+        self.allowed = set(top_searcher.docs_for_query(self.filter_query))
+
+    def matches(self):
+        for sub_docnum in self.child.matches():
+            if self.offset + sub_docnum in self.allowed:
+                yield sub_docnum
+
+    def all_ids(self):
+        return (docnum for docnum in self.child.all_ids() if docnum in self.allowed)
+
+    def computes_count(self):
+        return False
+
+    def count(self):
+        return sum(1 for _ in self.all_ids())
+
+    # len(results) counts the filtered pages
+    def results(self):
+        results = self.child.results()
+        results.collector = self
+        return results
+
+# LRU cache with time-to-live for search results
+# entries belong to one index generation, the cache is emptied when the index changes
+# (shared by the request threads, every access holds the lock)
+class ResultCache:
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            # mark as most recently used
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # empty the cache if the index has a new generation
+    def check_generation(self, generation):
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return round(self.hits / lookups, 3) if lookups else 0.0
 
 # search engine function
 class WhooshSearchEngine:
-    def __init__(self, index_dir):
+    # batch_scoring: score term queries with the vectorized NumPy scorer (same ranking as CustomScoring)
+    # lazy_snippets: return results without snippets, the page loads them from /snippets afterwards
+    # warm_queries: number of recent searches kept to warm up the next engine after a reload
+    # pinned: stay on the generation of the index that was opened (the background loader swaps in a new engine)
+    def __init__(self, index_dir, batch_scoring=False, lazy_snippets=False, warm_queries=20, pinned=False):
         self.index_dir = index_dir
-        self.ix = open_dir(index_dir)
+        self.ix = PinnedIndex(open_dir(index_dir)) if pinned else open_dir(index_dir)
+        # long-lived searchers, reused by the requests and refreshed when the index changes
+        self.searchers = SearcherPool(self.ix)
+        # page text of indices that do not store the content (None: the text is stored in the index)
+        self.content_store = open_store(index_dir)
+        # date filters and sorting by date need a DATETIME field (older indices store the date as text)
+        self.typed_dates = isinstance(self.ix.schema["create_date"], DATETIME)
+        # page embeddings for the semantic and hybrid search (None: index created without --embeddings or without numpy)
+        try:
+            from semantic_search import open_semantic_index # embeddings, needs numpy
+            self.semantic = open_semantic_index(index_dir, pinned)
+        except ImportError:
+            self.semantic = None
         self.settings = load_settings()
+        self.cache = ResultCache()
+        # highlighted fragments per (docnum, query terms), emptied with the result cache when the index changes
+        self.snippet_cache = ResultCache(max_entries=2048)
+        self.lazy_snippets = lazy_snippets
+        # maximum term frequency and idf per field, used as upper limit for the custom score
+        self.field_stats = load_field_stats(self.ix)
+        try:
+            from batch_scoring import BatchScoring # vectorized scoring, needs numpy
+        except ImportError:
+            BatchScoring = None
+        if batch_scoring and BatchScoring is None:
+            raise ImportError("batch_scoring needs numpy (pip install numpy)")
+        self.batch_scoring = batch_scoring
+        # the batch scorer is also needed for the window proximity mode
+        self.batch_scorer = BatchScoring(self.settings) if BatchScoring else None
+        # settings and batch scorer are replaced together (copy on write), a search reads both under this lock
+        self.settings_lock = threading.Lock()
+        # sorted terms for the autocomplete, loaded with the first request (rebuilt when the index changes)
+        self.term_index = None
+        self.term_index_generation = None
+        self.term_index_lock = threading.Lock()
+        # arguments of the last searches, replayed by the next engine when the index is reloaded
+        self.recent_queries = deque(maxlen=warm_queries)
+        # Configure highlighting (created once, the highlighter keeps no state between searches)
+        fragmenter = highlight.ContextFragmenter(maxchars=300, surround=75)
+        formatter = highlight.HtmlFormatter(tagname="mark", classname="match")
+        self.highlighter = highlight.Highlighter(fragmenter=fragmenter, formatter=formatter)
+
+    # open a searcher and load the caches of the first requests (segment files, autocomplete terms, document lengths)
+    # queries: search arguments (e.g. the recent queries of the previous engine), their results are cached
+    def warm_up(self, queries=()):
+        with self.searchers.searcher() as searcher:
+            if self.batch_scoring:
+                self.batch_scorer.doc_lengths(searcher, "content")
+        with self.term_index_lock:
+            self.term_index = load_term_index(self.ix)
+            self.term_index_generation = self.ix.latest_generation()
+        for args in dict.fromkeys(queries):
+            try:
+                self.search(*args)
+            except Exception:
+                # e.g. a semantic query after the embeddings were removed
+                pass
+
+    # close the idle searchers (the engine was replaced by a reload)
+    def close(self):
+        self.searchers.close()
 
+    # settings are never changed in place: running searches keep the settings they started with
     def update_settings(self, new_settings):
-        self.settings = new_settings.copy()
-        save_settings(self.settings)
+        settings = new_settings.copy()
+        with self.settings_lock:
+            save_settings(settings)
+            self.settings = settings
+            if self.batch_scorer:
+                self.batch_scorer = self.batch_scorer.with_settings(settings)
+        # cached results were ranked with the old weights
+        self.cache.clear()
 
+    # reload the field statistics and empty the caches if the index has a new generation
+    def check_generation(self):
+        generation = self.ix.latest_generation()
+        if generation != self.cache.generation:
+            with self.settings_lock:
+                self.field_stats = load_field_stats(self.ix)
+        self.cache.check_generation(generation)
+        self.snippet_cache.check_generation(generation)
+
+    # parse the query, returns the query object and whether the window mode is used
+    def parse_query(self, query, settings):
+        # Configure parser to handle phrases and multiple terms
+        parser = QueryParser("content", self.ix.schema, group=OrGroup)
+
+        # Window mode: multi-word queries match any term and are ranked by the distance between the terms
+        # (needs the batch scorer, without numpy the phrase mode is used)
+        window_mode = settings.get("proximity_mode", "phrase") == "window" and self.batch_scorer is not None
+
+        # Phrase mode: handle multi-word queries by wrapping in quotes if not already quoted
+        if not window_mode and " " in query and not (query.startswith('"') and query.endswith('"')):
+            query = f'"{query}"'
+
+        return parser.parse(query), window_mode
+
+    # date range filter from the query (create_date:...) and the date fields of the form
+    # returns the query without the date clauses and the filter query (None = no filter)
+    def date_filter(self, query, date_from=None, date_to=None):
+        ranges = [parse_date_clause(match.group(1)) for match in date_clause.finditer(query)]
+        query = " ".join(date_clause.sub(" ", query).split())
+        if date_from or date_to:
+            ranges.append(DateRange("create_date", date_bounds(date_from)[0] if date_from else None, date_bounds(date_to)[1] if date_to else None))
+        if not ranges or not self.typed_dates:
+            return query, None
+        return query, ranges[0] if len(ranges) == 1 else And(ranges)
+
+    # completions of the last word of a query, ranked by the number of pages containing the term
+    def autocomplete(self, query, limit=10):
+        words = query.lower().split()
+        if not words or query[-1].isspace():
+            return []
+        generation = self.ix.latest_generation()
+        with self.term_index_lock:
+            if self.term_index_generation != generation:
+                self.term_index = load_term_index(self.ix)
+                self.term_index_generation = generation
+            term_index = self.term_index
+        prefix = " ".join(words[:-1])
+        return [f"{prefix} {term}".strip() for term in term_index.complete(words[-1], limit)]
+
+    # highlighted snippet of a hit, the content of a page is only tokenized once per query terms
+    def snippet(self, hit, terms):
+        key = (hit.docnum, terms)
+        snippet = self.snippet_cache.get(key)
+        if snippet is None:
+            # the text of the page is read from the content store if the index does not store it
+            text = self.content_store.get(hit["path"], hit["page"]) if self.content_store else None
+            if text is None and "content" not in hit:
+                return ""
+            # Remove extra whitespace from snippets
+            snippet = ' '.join(self.highlighter.highlight_hit(hit, "content", text=text).split())
+            # pages without the query terms (semantic results, date filter only) show their beginning
+            if not snippet:
+                snippet = html.escape(' '.join((text or hit.get("content", "")).split())[:300])
+            self.snippet_cache.put(key, snippet)
+        return snippet
+
+    # snippets of several pages (list of (path, page)) for a query, in the same order ("" for removed pages)
+    # used by the page to load snippets after the results are shown, the pages are looked up by path and page
+    # because the document numbers of the shown results are not valid anymore after a reload of the index
+    def get_snippets(self, query, pages):
+        query = query.strip()
+        if not query:
+            return ["" for _ in pages]
+        self.check_generation()
+        myquery, _ = self.parse_query(query, self.settings)
+        terms = tuple(sorted(myquery.all_terms()))
+        with self.searchers.searcher() as searcher:
+            docnums = [searcher.document_number(path=path, page=page) for path, page in pages]
+            hits = Results(searcher, myquery, [(0.0, docnum) for docnum in docnums if docnum is not None])
+            snippets = {hit.docnum: self.snippet(hit, terms) for hit in hits}
+            return [snippets.get(docnum, "") for docnum in docnums]
+
+    # Group page hits by file name (indices without path column), returns the best hit and the sorted pages of the top_k files
     def get_top_results(self, results, top_k):
-        # Track seen documents to ensure we get top_k unique documents
-        seen_docs = set()
-        top_results = []
-        
+        best_hits = {}
+        pages = {}
         for result in results:
             file_name = result["file_name"]
-            if file_name not in seen_docs:
-                seen_docs.add(file_name)
-                top_results.append(result)
-                if len(top_results) >= top_k:
-                    break
-        return top_results
-
-    def search(self, query, top_k=10):
-        scorer = CustomScoring(self.settings)
-        
+            # keep the page with the highest score
+            if file_name not in best_hits or result.score > best_hits[file_name].score:
+                best_hits[file_name] = result
+            pages.setdefault(file_name, set()).add(result["page"])
+
+        # Sort by score descending and get top_k unique documents
+        top_results = sorted(best_hits.values(), key=lambda hit: round(hit.score, 3), reverse=True)[:top_k]
+        return [(hit, sorted(pages[hit["file_name"]])) for hit in top_results]
+
+    # All matching pages of the given files (by path), unscored
+    # (groupedby in the scored search would miss the pages skipped by the block quality limits)
+    def matching_pages(self, searcher, myquery, paths, date_filter=None):
+        groups = {path: [] for path in paths}
+        if not paths:
+            return groups
+        path_column = searcher.reader().column_reader("path")
+        subqueries = [myquery, Or([Term("path", path) for path in paths])]
+        if date_filter is not None:
+            subqueries.append(date_filter)
+        for docnum in searcher.docs_for_query(And(subqueries)):
+            groups[path_column[docnum]].append(docnum)
+        return groups
+
+    # Page numbers of documents, read from the page column (stored fields for indices without column)
+    def page_numbers(self, searcher, docnums):
+        reader = searcher.reader()
+        if reader.has_column("page"):
+            column = reader.column_reader("page")
+            return sorted({column[docnum] for docnum in docnums})
+        return sorted({searcher.stored_fields(docnum)["page"] for docnum in docnums})
+
+    # page: page number of the results (top_k files per page), starting at 1
+    # date_from, date_to: date range (YYYY, YYYY-MM or YYYY-MM-DD), runs as indexed filter query together with create_date:... in the query
+    # sort: "score", "date_desc" or "date_asc" (newest / oldest files first)
+    # mode: "lexical", "semantic" (embeddings) or "hybrid" (both rankings fused), see semantic_search
+    # snippets=False leaves out the snippets (used for the lexical ranking of the hybrid search)
+    def search(self, query, top_k=10, page=1, date_from=None, date_to=None, sort="score", mode="lexical", snippets=True):
         # Initialize metrics
         metrics = {
             "start_time": time.time(),
             "total_docs": 0,
-            "results_count": 0
+            "results_count": 0,
+            "cache_hit": False,
+            "page": page,
+            "has_next": False,
+            "mode": mode
         }
         
-        # Sanitize and prepare query
-        query = query.strip()
-        if not query:
+        # the last queries are used to warm up the index after a reload (calls without snippets are part of a hybrid search)
+        if snippets:
+            self.recent_queries.append((query, top_k, page, date_from, date_to, sort, mode))
+
+        # Sanitize and prepare query, the date clauses become a filter
+        full_query = query.strip()
+        query, date_filter = self.date_filter(full_query, date_from, date_to)
+        if not query and date_filter is None:
             return [], metrics
+        # a query with only a date range has nothing to compare with the embeddings
+        if mode != "lexical" and query:
+            return self.semantic_search(full_query, top_k, page, date_from, date_to, mode, metrics)
+        metrics["mode"] = "lexical"
+
+        # Return cached results for repeated queries (same query, top_k, page and scoring settings on the same index)
+        self.check_generation()
+        # one consistent snapshot of the settings for this search
+        with self.settings_lock:
+            settings, batch_scorer, field_stats = self.settings, self.batch_scorer, self.field_stats
+        cache_key = (query, top_k, page, date_filter, sort, snippets, tuple(sorted(settings.items())))
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            output, metrics["total_docs"], metrics["results_count"], metrics["has_next"] = cached
+            metrics["cache_hit"] = True
+            metrics["cache_hit_rate"] = self.cache.hit_rate()
+            metrics["duration"] = round((time.time() - metrics["start_time"]) * 1000, 2)  # in milliseconds
+            return list(output), metrics
+
+        scorer = CustomScoring(settings, field_stats)
         
-        # Configure highlighting
-        fragmenter = highlight.ContextFragmenter(maxchars=300, surround=75)
-        formatter = highlight.HtmlFormatter(tagname="mark", classname="match")
-        highlighter = highlight.Highlighter(fragmenter=fragmenter, formatter=formatter)
-        
-        with self.ix.searcher(weighting=scorer) as searcher:
-            # Configure parser to handle phrases and multiple terms
-            parser = QueryParser("content", self.ix.schema, group=OrGroup)
-            
+        with self.searchers.searcher(weighting=scorer) as searcher:
             # Get total documents in index
             metrics["total_docs"] = searcher.doc_count_all()
             
-            # Handle multi-word queries by wrapping in quotes if not already quoted
-            if " " in query and not (query.startswith('"') and query.endswith('"')):
-                query = f'"{query}"'
-                
-            myquery = parser.parse(query)
-            # Get more results initially to handle grouping
-            results = searcher.search(myquery, limit=top_k * 3, terms=True)
+            # a query with only date clauses lists all pages in the date range
+            myquery, window_mode = self.parse_query(query, settings) if query else (Every(), False)
+            # sorted by date: no scores needed, whoosh reads the order from the create_date column
+            sort_args = {}
+            if sort in ("date_desc", "date_asc") and self.typed_dates:
+                sort_args = {"sortedby": "create_date", "reverse": sort == "date_desc"}
+            use_batch_scorer = batch_scorer and batch_scorer.supports(myquery) and (window_mode or self.batch_scoring) and not sort_args
+            # files of all pages up to the requested one, plus one file to know if there is a next page
+            start = (page - 1) * top_k
+            limit = page * top_k + 1
+            if searcher.reader().has_column("path"):
+                # One hit per file: pages are collapsed by the path column
+                if use_batch_scorer:
+                    # the batch scorer has all scores, its groups list the matching pages of the returned files
+                    results = batch_scorer.search(searcher, myquery, limit=limit, window=window_mode, collapse="path", filter=date_filter)
+                    hits = list(results)
+                    groups = results.groups("path")
+                else:
+                    collector = searcher.collector(limit=limit, collapse=sorting.FieldFacet("path"), terms=True, **sort_args)
+                    if date_filter is not None:
+                        # the date filter runs below the collapse collector
+                        collector.child = FilterMatchesCollector(collector.child, date_filter)
+                    searcher.search_with_collector(myquery, collector)
+                    results = collector.results()
+                    hits = list(results)
+                    groups = self.matching_pages(searcher, myquery, [hit["path"] for hit in hits[start:start + top_k]], date_filter)
+                metrics["has_next"] = len(hits) > start + top_k
+                top_results = [(hit, self.page_numbers(searcher, groups[hit["path"]])) for hit in hits[start:start + top_k]]
+            else:
+                # Indices without path column: get more results initially and group them by file name
+                if use_batch_scorer:
+                    results = batch_scorer.search(searcher, myquery, limit=limit * 3, window=window_mode, filter=date_filter)
+                else:
+                    results = searcher.search(myquery, limit=limit * 3, filter=date_filter, terms=True)
+                top_results = self.get_top_results(results, limit)
+                metrics["has_next"] = len(top_results) > start + top_k
+                top_results = top_results[start:start + top_k]
             
             # Get total documents in index
             metrics["total_docs"] = searcher.doc_count_all()
             metrics["results_count"] = len(results)
             
-            # Group results by document name
-            grouped_results = {}
-            for result in results:
-                file_name = result["file_name"]
-                if file_name not in grouped_results:
-                    grouped_results[file_name] = {
-                        "file_name": file_name,
-                        "path": result["path"].replace('/', '\\'),
-                        "pages": [result["page"]],
-                        "score": result.score,
-                        "snippet": highlighter.highlight_hit(result, "content"),
-                        "author": result.get("author", "Unknown"),
-                        "create_date": result.get("create_date", "Unknown")
-                    }
-                else:
-                    # Only append page if not already present
-                    if result["page"] not in grouped_results[file_name]["pages"]:
-                        grouped_results[file_name]["pages"].append(result["page"])
-                    # Update snippet and score only if this result has a higher score
-                    if result.score > grouped_results[file_name]["score"]:
-                        grouped_results[file_name]["score"] = result.score
-                        grouped_results[file_name]["snippet"] = highlighter.highlight_hit(result, "content")
-            
-            # Sort pages within each group and format them
+            # Format the files, only the best page of the shown files is highlighted
+            # (with lazy snippets the page loads them from /snippets)
+            terms = tuple(sorted(myquery.all_terms()))
             output = []
-            for doc in grouped_results.values():
-                doc["pages"].sort()
-                doc["page"] = ", ".join(map(str, doc["pages"]))
-                # Remove extra whitespace from snippets
-                doc["snippet"] = ' '.join(doc["snippet"].split())
-                doc["score"] = round(doc["score"], 3)
-                output.append(doc)
-            
-            # Sort by score descending
-            output.sort(key=lambda x: x["score"], reverse=True)
-            
-            # Get top_k unique documents
-            output = output[:top_k]
+            for hit, pages in top_results:
+                output.append({
+                    "file_name": hit["file_name"],
+                    "path": hit["path"].replace('/', '\\'),
+                    "pages": pages,
+                    "page": ", ".join(map(str, pages)),
+                    # sorted by date the hits have no score
+                    "score": None if sort_args else round(hit.score, 3),
+                    "docnum": hit.docnum,
+                    # page of the snippet, the page loads lazy snippets by path and page (document numbers change when the index is reloaded)
+                    "snippet_path": hit["path"],
+                    "snippet_page": hit["page"],
+                    "snippet": None if self.lazy_snippets or not snippets else self.snippet(hit, terms),
+                    "author": hit.get("author", "Unknown"),
+                    "create_date": str(hit.get("create_date", "Unknown"))
+                })
+            self.cache.put(cache_key, (output, metrics["total_docs"], metrics["results_count"], metrics["has_next"]))
+            metrics["cache_hit_rate"] = self.cache.hit_rate()
             
             # Calculate search duration
             metrics["duration"] = round((time.time() - metrics["start_time"]) * 1000, 2)  # in milliseconds
             
             return output, metrics
 
+    # Semantic search: the files with the pages most similar to the query (cosine similarity of the embeddings)
+    # hybrid: the lexical and the semantic ranking of the files are fused by reciprocal rank fusion,
+    # each ranking contributes at least fusion_depth files
+    def semantic_search(self, query, top_k, page, date_from, date_to, mode, metrics, fusion_depth=50):
+        if self.semantic is None:
+            raise ValueError("Der Index hat keine Embeddings (directory_indexer.py --embeddings).")
+        query_text, date_filter = self.date_filter(query, date_from, date_to)
+        self.check_generation()
+        with self.settings_lock:
+            settings = self.settings
+        # the semantic ranking does not depend on the scoring settings, the hybrid ranking does
+        cache_key = (mode, query_text, top_k, page, date_filter, tuple(sorted(settings.items())) if mode == "hybrid" else None)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            output, metrics["total_docs"], metrics["results_count"], metrics["has_next"] = cached
+            metrics["cache_hit"] = True
+            metrics["cache_hit_rate"] = self.cache.hit_rate()
+            metrics["duration"] = round((time.time() - metrics["start_time"]) * 1000, 2)  # in milliseconds
+            return list(output), metrics
+
+        start = (page - 1) * top_k
+        depth = max(page * top_k + 1, fusion_depth)
+        try:
+            # several pages per file, so there are enough different files
+            page_hits = self.semantic.search(query_text, limit=depth * 5)
+        except ImportError:
+            raise ValueError("Die semantische Suche braucht sentence-transformers (pip install sentence-transformers).")
+        lexical = []
+        if mode == "hybrid":
+            lexical, _ = self.search(query, top_k=depth, page=1, date_from=date_from, date_to=date_to, snippets=False)
+
+        with self.searchers.searcher() as searcher:
+            metrics["total_docs"] = searcher.doc_count_all()
+            allowed = set(searcher.docs_for_query(date_filter)) if date_filter is not None else None
+            # best page of every file (the most similar files first) and all similar pages of the file
+            files = OrderedDict()
+            for similarity, path, page_number in page_hits:
+                docnum = searcher.document_number(path=path, page=page_number)
+                # pages removed since the embeddings were computed and pages outside of the date range
+                if docnum is None or (allowed is not None and docnum not in allowed):
+                    continue
+                key = path.replace('/', '\\')
+                if key not in files:
+                    files[key] = {"similarity": similarity, "docnum": docnum, "pages": set()}
+                files[key]["pages"].add(page_number)
+
+            lexical_results = {result["path"]: result for result in lexical}
+            if mode == "hybrid":
+                from semantic_search import reciprocal_rank_fusion # loaded with the semantic index
+                ranking = reciprocal_rank_fusion([list(lexical_results), list(files)])
+            else:
+                ranking = [(key, semantic["similarity"]) for key, semantic in files.items()]
+            metrics["results_count"] = len(ranking)
+            metrics["has_next"] = len(ranking) > start + top_k
+
+            myquery, _ = self.parse_query(query_text, settings)
+            terms = tuple(sorted(myquery.all_terms()))
+            output = []
+            for key, score in ranking[start:start + top_k]:
+                semantic = files.get(key)
+                if key in lexical_results:
+                    result = dict(lexical_results[key])
+                    pages = set(result["pages"]) | (semantic["pages"] if semantic else set())
+                else:
+                    fields = searcher.stored_fields(semantic["docnum"])
+                    result = {
+                        "file_name": fields["file_name"],
+                        "path": key,
+                        "docnum": semantic["docnum"],
+                        "snippet_path": fields["path"],
+                        "snippet_page": fields["page"],
+                        "author": fields.get("author", "Unknown"),
+                        "create_date": str(fields.get("create_date", "Unknown"))
+                    }
+                    pages = semantic["pages"]
+                result["pages"] = sorted(pages)
+                result["page"] = ", ".join(map(str, result["pages"]))
+                # hybrid: fused score of the two ranks, semantic: cosine similarity of the best page
+                result["score"] = round(score, 4) if mode == "hybrid" else round(score, 3)
+                result["snippet"] = None
+                if not self.lazy_snippets:
+                    hit = Results(searcher, myquery, [(0.0, result["docnum"])])[0]
+                    result["snippet"] = self.snippet(hit, terms)
+                output.append(result)
+
+        self.cache.put(cache_key, (output, metrics["total_docs"], metrics["results_count"], metrics["has_next"]))
+        metrics["cache_hit_rate"] = self.cache.hit_rate()
+        metrics["duration"] = round((time.time() - metrics["start_time"]) * 1000, 2)  # in milliseconds
+        return output, metrics
+
 # declaration of index path
 index_dir = r".\whoosh_index" # Path to the index directory **change this to your index directory**
-search_engine = WhooshSearchEngine(index_dir)
+batch_scoring = False # True: use the vectorized NumPy scorer for term queries
+lazy_snippets = False # True: show the result list first and load the snippets afterwards
+reload_interval = 5 # seconds between the checks for a new index version (None: only reload with /admin/reload)
+warm_queries = 20 # number of recent queries replayed on a reloaded index
+
+# Function to open and warm up the search engine (runs in the background, the app serves requests meanwhile)
+# after a re-index the recent queries of the previous engine are replayed, so the new index starts with warm caches
+def open_search_engine(previous=None):
+    engine = WhooshSearchEngine(index_dir, batch_scoring=batch_scoring, lazy_snippets=lazy_snippets, warm_queries=warm_queries, pinned=True)
+    engine.warm_up(list(previous.recent_queries) if previous else ())
+    return engine
+
+engine_loader = BackgroundLoader(open_search_engine, reload_interval)
+
+# the index is opened by the process that serves the requests (started by serve() and the main program,
+# this hook starts it for other WSGI servers), importing the module does not open it
+@app.before_request
+def start_engine_loader():
+    engine_loader.start()
+
+# page shown while the index is loading (or could not be opened), the settings are read from the settings file
+def loading_page():
+    return render_template("index.html", error=engine_loader.message(), settings=load_settings(), semantic=False), 503
 
 # definition of template file for rendering output
 @app.route("/")
 def home():
-    return render_template("index.html", settings=search_engine.settings)
+    search_engine = engine_loader.engine
+    if search_engine is None:
+        return loading_page()
+    return render_template("index.html", settings=search_engine.settings, semantic=search_engine.semantic is not None)
 
 # function to get search query and render results or error messages
 @app.route("/search", methods=["POST"])
 def search():
+    search_engine = engine_loader.engine
+    if search_engine is None:
+        return loading_page()
     query = request.form.get("query")
     results_per_page = int(request.form.get("results_per_page", 10))
+    page = max(1, int(request.form.get("page", 1)))
+    date_from = request.form.get("date_from", "")
+    date_to = request.form.get("date_to", "")
+    sort = request.form.get("sort", "score")
+    mode = request.form.get("mode", "lexical")
     
-    if not query or not query.strip():
-        return render_template("index.html", error="Bitte Suchbegriff eintragen.", settings=search_engine.settings)
+    # a date range alone lists all files of that period
+    if (not query or not query.strip()) and not date_from and not date_to:
+        return render_template("index.html", error="Bitte Suchbegriff eintragen.", settings=search_engine.settings, semantic=search_engine.semantic is not None)
 
     # Trim whitespace
-    query = query.strip()
-    results, metrics = search_engine.search(query, top_k=results_per_page)
+    query = (query or "").strip()
+    try:
+        results, metrics = search_engine.search(query, top_k=results_per_page, page=page, date_from=date_from, date_to=date_to, sort=sort, mode=mode)
+    except ValueError as e:
+        return render_template("index.html", error=str(e), settings=search_engine.settings, semantic=search_engine.semantic is not None)
     if not results:
-        return render_template("index.html", error="Keine Ergebnisse gefunden.", settings=search_engine.settings)
+        return render_template("index.html", error="Keine Ergebnisse gefunden.", settings=search_engine.settings, semantic=search_engine.semantic is not None)
+
+    return render_template("index.html", results=results, query=query, settings=search_engine.settings, semantic=search_engine.semantic is not None, metrics=metrics)
 
-    return render_template("index.html", results=results, query=query, settings=search_engine.settings, metrics=metrics)
+# function to suggest completions while typing
+@app.route("/autocomplete")
+def autocomplete():
+    query = request.args.get("q", "")
+    search_engine = engine_loader.engine
+    return jsonify({"status": "success", "suggestions": search_engine.autocomplete(query) if search_engine else []})
+
+# JSON search API, parameters q (query), top_k (results per page), page, date_from, date_to, sort and mode as query string or form data
+@app.route("/api/search", methods=["GET", "POST"])
+def api_search():
+    search_engine = engine_loader.engine
+    if search_engine is None:
+        return jsonify({"status": "error", "message": engine_loader.message()}), 503
+    query = request.values.get("q", "")
+    try:
+        top_k = min(100, max(1, int(request.values.get("top_k", 10))))
+        page = max(1, int(request.values.get("page", 1)))
+    except ValueError:
+        return jsonify({"status": "error", "message": "top_k and page must be numbers"}), 400
+    date_from = request.values.get("date_from", "")
+    date_to = request.values.get("date_to", "")
+    sort = request.values.get("sort", "score")
+    if sort not in ("score", "date_desc", "date_asc"):
+        return jsonify({"status": "error", "message": "sort must be 'score', 'date_desc' or 'date_asc'"}), 400
+    mode = request.values.get("mode", "lexical")
+    if mode not in ("lexical", "semantic", "hybrid"):
+        return jsonify({"status": "error", "message": "mode must be 'lexical', 'semantic' or 'hybrid'"}), 400
+    if not query.strip() and not date_from and not date_to:
+        return jsonify({"status": "error", "message": "Bitte Suchbegriff eintragen."}), 400
+
+    try:
+        results, metrics = search_engine.search(query, top_k=top_k, page=page, date_from=date_from, date_to=date_to, sort=sort, mode=mode)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "query": query.strip(), "results": results, "metrics": metrics})
+
+# function to load snippets of the shown results (used when lazy_snippets is active)
+@app.route("/snippets", methods=["POST"])
+def snippets():
+    search_engine = engine_loader.engine
+    if search_engine is None:
+        return jsonify({"status": "error", "message": engine_loader.message()}), 503
+    query = request.form.get("query", "")
+    paths = request.form.getlist("path")
+    try:
+        pages = [int(page) for page in request.form.getlist("page")]
+    except ValueError:
+        return jsonify({"status": "error", "message": "invalid page"})
+    if len(paths) != len(pages):
+        return jsonify({"status": "error", "message": "one page per path expected"})
+    return jsonify({"status": "success", "snippets": search_engine.get_snippets(query, list(zip(paths, pages)))})
 
 # function to update scoring options in web app
 @app.route("/update_settings", methods=["POST"])
 def update_settings():
+    search_engine = engine_loader.engine
+    if search_engine is None:
+        return jsonify({"status": "error", "message": engine_loader.message()}), 503
     try:
         new_settings = {
             "proximity_weight": float(request.form.get("proximity_weight", 1.5)),
             "position_weight": float(request.form.get("position_weight", 2.0)),
-            "idf_weight": float(request.form.get("idf_weight", 1.0))
+            "idf_weight": float(request.form.get("idf_weight", 1.0)),
+            "proximity_mode": request.form.get("proximity_mode", "phrase")
         }
+        if new_settings["proximity_mode"] not in ("phrase", "window"):
+            raise ValueError("proximity_mode must be 'phrase' or 'window'")
         search_engine.update_settings(new_settings)
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+# function to load a new index without restart (e.g. called by the indexing job), only from the local computer
+# the current index serves the requests until the new one is opened and warmed up
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        return jsonify({"status": "error", "message": "only allowed from localhost"}), 403
+    started = engine_loader.reload()
+    return jsonify({"status": "success", "reloading": started, "generation": engine_loader.version[0] if engine_loader.version else None}), 202
+
+# production mode: several worker threads share the search engine (one index, one searcher per request from the pool)
+# uses waitress if installed (pip install waitress), otherwise the threaded werkzeug server
+def serve(host="127.0.0.1", port=5000, threads=8):
+    engine_loader.start()
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        waitress_serve = None
+    if waitress_serve:
+        waitress_serve(app, host=host, port=port, threads=threads)
+    else:
+        print("waitress not installed, using the threaded werkzeug server")
+        from werkzeug.serving import run_simple
+        run_simple(host, port, app, threaded=True)
+
 # main program -> start web app
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="CAS search engine web app.")
+    arg_parser.add_argument("--production", action="store_true", help="serve with several worker threads instead of the debug server")
+    arg_parser.add_argument("--host", default="127.0.0.1", help="address of the web app")
+    arg_parser.add_argument("--port", type=int, default=5000, help="port of the web app")
+    arg_parser.add_argument("--threads", type=int, default=8, help="worker threads in production mode (waitress)")
+    args = arg_parser.parse_args()
+
+    if args.production:
+        serve(args.host, args.port, args.threads)
+    else:
+        # the debug server serves from a child process (reloader), the parent process only watches the files
+        if is_running_from_reloader():
+            engine_loader.start()
+        app.run(debug=True, host=args.host, port=args.port)
\ No newline at end of file
@@ -1,34 +1,91 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify
+from werkzeug.serving import is_running_from_reloader
 from whoosh.index import open_dir
 from whoosh.qparser import QueryParser
 from whoosh.qparser import MultifieldParser
+from whoosh.fields import ID
+from whoosh.query import Term
+from searcher_pool import SearcherPool, PinnedIndex
+from content_store import open_store
+from background_loader import BackgroundLoader
 
 # define environment for web app (Flask)
 app = Flask(__name__)
 
+# author facet: list of authors with number of pages, rebuilt only when the index changes
+class AuthorFacet:
+    def __init__(self, ix):
+        self.ix = ix
+        self.generation = None
+        self.counts = {}
+        self.docnums = {}
+
+    def refresh(self):
+        generation = self.ix.latest_generation()
+        if generation == self.generation:
+            return
+        with self.ix.searcher() as searcher:
+            if isinstance(self.ix.schema["author"], ID):
+                # author is an ID field: every author is one term of the lexicon, the doc frequency is the page count
+                self.counts = {term.decode("utf-8"): info.doc_frequency() for term, info in searcher.reader().iter_field("author")}
+                self.docnums = {}
+            else:
+                # older indices with an analyzed author field: read the stored fields once and remember the pages per author
+                self.docnums = {}
+                for docnum, fields in searcher.iter_docs():
+                    self.docnums.setdefault(fields.get("author", "Unknown"), set()).add(docnum)
+                self.counts = {author: len(docnums) for author, docnums in self.docnums.items()}
+        self.generation = generation
+
+    def authors(self):
+        self.refresh()
+        return sorted(self.counts)
+
+    # filter for the search: an indexed term query, or the cached document numbers for older indices
+    def filter(self, author):
+        self.refresh()
+        if isinstance(self.ix.schema["author"], ID):
+            return Term("author", author)
+        return self.docnums.get(author, set())
+
 # search engine function (extende with optional limitation of search within author-list)
 class WhooshSearchEngine:
     # open index
-    def __init__(self, index_dir):
-        self.ix = open_dir(index_dir)
+    # pinned: stay on the generation of the index that was opened (the background loader swaps in a new engine)
+    def __init__(self, index_dir, pinned=False):
+        self.ix = PinnedIndex(open_dir(index_dir)) if pinned else open_dir(index_dir)
+        # long-lived searchers, reused by the requests and refreshed when the index changes
+        self.searchers = SearcherPool(self.ix)
+        # page text of indices that do not store the content
+        self.content_store = open_store(index_dir)
+        self.author_facet = AuthorFacet(self.ix)
+
+    # close the idle searchers (the engine was replaced by a reload)
+    def close(self):
+        self.searchers.close()
 
-    # get list of authors from the index
+    # get list of authors from the index (cached until the index changes)
     def get_authors(self):
-        with self.ix.searcher() as searcher:
-            authors = set()
-            for fields in searcher.all_stored_fields():
-                author = fields.get("author", "Unknown")
-                authors.add(author)
-            return sorted(authors)
-
-    # search function
-    def search(self, query, author=None, top_k=10):  # limitation of result amount to 10
-        with self.ix.searcher() as searcher:
-            parser = MultifieldParser(["content", "author"], self.ix.schema)
+        return self.author_facet.authors()
+
+    # get number of pages per author
+    def get_author_counts(self):
+        self.author_facet.refresh()
+        return self.author_facet.counts
+
+    # search function, returns the results of one page (top_k results per page) and the number of pages
+    def search(self, query, author=None, top_k=10, page=1):  # limitation of result amount to 10
+        with self.searchers.searcher() as searcher:
+            # an ID author field only matches the complete name, the words of the query are then only searched in the content
+            # (the author list filters by author; older indices with a TEXT author field still match words of the name)
+            fieldnames = ["content"] if isinstance(self.ix.schema["author"], ID) else ["content", "author"]
+            parser = MultifieldParser(fieldnames, self.ix.schema)
             myquery = parser.parse(query)
+            # restrict the search to the pages of one author with an indexed filter
+            author_filter = None
             if author and author != "Alle":
-                myquery = myquery & parser.parse(f"author:{author}")
-            results = searcher.search(myquery, limit=top_k)
+                author_filter = self.author_facet.filter(author)
+            results = searcher.search_page(myquery, page, pagelen=top_k, filter=author_filter)
             output = []
             # create data for output in web app
             for result in results:
@@ -37,38 +94,71 @@ class WhooshSearchEngine:
                     "path": result["path"].replace('/', '\\'),  # replace \ with / to get consistent file paths
                     "page": result["page"],
                     "score": round(result.score, 2),
-                    "snippet": result.highlights("content"),
+                    "snippet": result.highlights("content", text=self.content_store.get(result["path"], result["page"]) if self.content_store else None),
                     "author": result.get("author", "Unknown"),
                     "create_date": result.get("create_date", "Unknown")
                 })
-            return output
+            return output, results.pagecount
 
 # declaration of index path - make sure the correct path is configured
 index_dir = r".\whoosh_index"
-search_engine = WhooshSearchEngine(index_dir)
+reload_interval = 5 # seconds between the checks for a new index version (None: only reload with /admin/reload)
+
+# Function to open the search engine and read the author list (runs in the background, the app serves requests meanwhile)
+def open_search_engine(previous=None):
+    engine = WhooshSearchEngine(index_dir, pinned=True)
+    engine.get_authors()
+    return engine
+
+engine_loader = BackgroundLoader(open_search_engine, reload_interval)
+
+# the index is opened by the process that serves the requests, importing the module does not open it
+@app.before_request
+def start_engine_loader():
+    engine_loader.start()
 
 # define .html template for web app
 @app.route("/")
 def home():
+    search_engine = engine_loader.engine
+    if search_engine is None:
+        return render_template("index_author.html", error=engine_loader.message(), authors=[], author_counts={}), 503
     authors = search_engine.get_authors()
-    return render_template("index_author.html", authors=authors)
+    return render_template("index_author.html", authors=authors, author_counts=search_engine.get_author_counts())
 
 # get search query(ies) and hand over to the search engine
 @app.route("/search", methods=["POST"])
 def search():
     query = request.form.get("query")
     selected_author = request.form.get("author")
+    page = max(1, int(request.form.get("page", 1)))
+    search_engine = engine_loader.engine
+    if search_engine is None:
+        return render_template("index_author.html", error=engine_loader.message(), authors=[], author_counts={}), 503
+    authors = search_engine.get_authors()
+    author_counts = search_engine.get_author_counts()
     if not query:
-        return render_template("index_author.html", error="Bitte Suchbegriff eintragen.", authors=search_engine.get_authors())
+        return render_template("index_author.html", error="Bitte Suchbegriff eintragen.", authors=authors, author_counts=author_counts)
 
-    results = search_engine.search(query, author=selected_author)
+    results, pagecount = search_engine.search(query, author=selected_author, page=page)
     if not results:
-        return render_template("index_author.html", error="Keine Ergebnisse gefunden.", authors=search_engine.get_authors())
+        return render_template("index_author.html", error="Keine Ergebnisse gefunden.", authors=authors, author_counts=author_counts)
+
+    return render_template("index_author.html", results=results, query=query, authors=authors, author_counts=author_counts, selected_author=selected_author,
+                           page=min(page, pagecount), pagecount=pagecount)
 
-    return render_template("index_author.html", results=results, query=query, authors=search_engine.get_authors(), selected_author=selected_author)
+# function to load a new index without restart, only from the local computer
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    if request.remote_addr not in ("127.0.0.1", "::1"):
+        return jsonify({"status": "error", "message": "only allowed from localhost"}), 403
+    return jsonify({"status": "success", "reloading": engine_loader.reload()}), 202
 
 # main program -> start web app (webserver will run on local instance on http://127.0.0.1:5000)
 if __name__ == "__main__":
+    # the debug server serves from a child process (reloader), the parent process only watches the files
+    if is_running_from_reloader():
+        engine_loader.start()
     app.run(debug=True)
 
 # press Ctrl-C to interrupt